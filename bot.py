@@ -1,36 +1,56 @@
 import logging
+from utils.misc.startup import startup  # первым: от него отсчитывается время запуска
 from aiogram import Bot, Dispatcher, executor, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.dispatcher.filters import CommandStart
+from aiogram.utils.exceptions import MessageNotModified
 from datetime import datetime
-import os
-from environs import Env
-import gspread
-from google.oauth2.service_account import Credentials
-import platform
-import sqlite3
-import psycopg2
-from psycopg2 import sql, IntegrityError
-import re
-
-# Загрузка переменных окружения
-env = Env()
-env.read_env()
-API_TOKEN = env.str('BOT_TOKEN')
 
-logging.basicConfig(level=logging.INFO)
+from data.config import env, ADMINS, BOT_MODE, STARTUP_BROADCAST_COOLDOWN, LOG_LEVEL, LOG_FORMAT, LOG_DEBUG_SAMPLE
+from utils.sheets_api.dashboard import dashboard
+from utils.sheets_api.summary import BALANCE_CELLS, read_cells
+from utils.sheets_api.report import all_report
+from utils.sheets_api.writer import sheet_writer
+from utils.misc.blocking import blocking_io, run_blocking
+from utils.misc.logging import setup_logging, set_debug_sample
+from utils.misc.metrics import metrics_server
+from utils.misc.formatting import clean_emoji, split_emoji_and_text
+from utils.misc.throttling import rate_limit
+from utils.misc.access import admin_only
+from utils.misc.broadcast import broadcaster
+from utils.db_api.pool import pool
+from utils.db_api.migrations import migrate, DEFAULT_CATEGORIES
+from utils.db_api.database import db, access_cache, user_reads
+from utils.db_api.fsm_storage import PostgresStorage
+from utils.db_api.listener import cache_listener
+from utils.db_api.balances import BALANCE_LABELS, parse_amount, format_amount
+from keyboards.inline.catalog import categories_kb, pay_types_kb
+from keyboards.inline.pagination import page_kb
+from middlewares.metrics import MetricsMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.security_middleware import SecurityMiddleware, Access, access_denied_text
+
+API_TOKEN = env.str('BOT_TOKEN')
 
 bot = Bot(token=API_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(bot, storage=MemoryStorage())
+dp = Dispatcher(bot, storage=PostgresStorage())
+broadcaster.bot = bot
 
 # Состояния
 class Form(StatesGroup):
     waiting_name = State()
     waiting_phone = State()
 
+# Метрики первыми: время обработчика включает проверки доступа и частоты
+dp.middleware.setup(MetricsMiddleware())
+# Лишние запросы отсекаются раньше проверки доступа, которая может читать состояние FSM
+throttling = ThrottlingMiddleware()
+dp.middleware.setup(throttling)
+# Доступ проверяется один раз на апдейт, до фильтров; регистрация доступна без него
+security = SecurityMiddleware(public_commands=['start', 'register'], public_states=Form.all_states_names)
+dp.middleware.setup(security)
+
 # Кнопки выбора Kirim/Chiqim
 start_kb = InlineKeyboardMarkup(row_width=2)
 start_kb.add(
@@ -39,95 +59,13 @@ start_kb.add(
 )
 
 # Категории
-categories = [
-    ("Мижозлардан", "cat_mijozlar"),
-    ("Аренда техника и инструменты", "cat_arenda"),
-    ("Бетон тайёрлаб бериш", "cat_beton"),
-    ("Геология ва лойиха ишлари", "cat_geologiya"),
-    ("Геология ишлари", "cat_geologiya_ish"),
-    ("Диз топливо для техники", "cat_diz"),
-    ("Дорожные расходы", "cat_doroga"),
-    ("Заправка", "cat_zapravka"),
-    ("Коммунал и интернет", "cat_kommunal"),
-    ("Кунлик ишчи", "cat_kunlik"),
-    ("Объем усталар", "cat_ustalar"),
-    ("Перевод", "cat_perevod"),
-    ("Ойлик ишчилар", "cat_oylik"),
-    ("Олиб чикиб кетилган мусор", "cat_musor"),
-    ("Перечесления Расход", "cat_perechisleniya"),
-    ("Питание", "cat_pitanie"),
-    ("Прочие расходы", "cat_prochie"),
-    ("Ремонт техники и запчасти", "cat_remont"),
-    ("Сотиб олинган материал", "cat_material"),
-    ("Карз", "cat_qarz"),
-    ("Сотиб олинган снос уйлар", "cat_snos"),
-    ("Валюта операция", "cat_valyuta"),
-    ("Хизмат (Прочие расходы)", "cat_xizmat"),
-    ("Хоз товары и инвентарь", "cat_xoz"),
-    ("SXF Kapital", "cat_sxf"),
-    ("Хожи Ака", "cat_xoji"),
-    ("Эхсон", "cat_exson"),
-    ("Хомийлик", "cat_xomiy")
-]
-
-# Словарь соответствий: категория -> эмодзи (теперь не используется, но оставляем для совместимости)
-category_emojis = {
-    "Мижозлардан": "",
-    "Аренда техника и инструменты": "",
-    "Бетон тайёрлаб бериш": "",
-    "Геология ва лойиха ишлари": "",
-    "Геология ишлари": "",
-    "Диз топливо для техники": "",
-    "Дорожные расходы": "",
-    "Заправка": "",
-    "Коммунал и интернет": "",
-    "Кунлик ишчи": "",
-    "Объем усталар": "",
-    "Перевод": "",
-    "Ойлик ишчилар": "",
-    "Олиб чикиб кетилган мусор": "",
-    "Перечесления Расход": "",
-    "Питание": "",
-    "Прочие расходы": "",
-    "Ремонт техники и запчасти": "",
-    "Сотиб олинган материал": "",
-    "Карз": "",
-    "Сотиб олинган снос уйлар": "",
-    "Валюта операция": "",
-    "Хизмат (Прочие расходы)": "",
-    "Хоз товары и инвентарь": "",
-    "SXF Kapital": "",
-    "Хожи Ака": "",
-    "Эхсон": "",
-    "Хомийлик": ""
-}
-
-def get_category_with_emoji(category_name):
-    emoji = category_emojis.get(category_name, "")
-    return f"{emoji} {category_name}".strip()
-
-def get_categories_kb():
-    kb = InlineKeyboardMarkup(row_width=2)
-    for name in get_categories():
-        cb = f"cat_{name}"
-        # Просто показываем название категории без эмодзи
-        kb.add(InlineKeyboardButton(name, callback_data=cb))
-    return kb
+async def get_categories_kb():
+    # Просто показываем название категории без эмодзи
+    return await categories_kb('cat_', row_width=2)
 
 # Тип оплаты
-pay_types = [
-    ("Plastik", "pay_plastik"),
-    ("Naxt", "pay_naxt"),
-    ("Perevod", "pay_perevod"),
-    ("Bank", "pay_bank")
-]
-
-def get_pay_types_kb():
-    kb = InlineKeyboardMarkup(row_width=2)
-    for name in get_pay_types():
-        cb = f"pay_{name}"
-        kb.add(InlineKeyboardButton(name, callback_data=cb))
-    return kb
+async def get_pay_types_kb():
+    return await pay_types_kb('pay_', row_width=2)
 
 # Кнопка пропуска для Izoh
 skip_kb = InlineKeyboardMarkup().add(InlineKeyboardButton("Пропустить", callback_data="skip_comment"))
@@ -139,257 +77,39 @@ confirm_kb.add(
     InlineKeyboardButton('❌ Yoq', callback_data='confirm_no')
 )
 
-# --- Google Sheets settings ---
-SHEET_ID = '10KP00nakL0LK9lyB7jQrfUtmtIQO6gzqJDP0rogTEww'
-SHEET_NAME = 'Dashboard1'
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-CREDENTIALS_FILE = 'credentials.json'
-
-def clean_emoji(text):
-    # Удаляет только эмодзи/спецсимволы в начале строки, остальной текст не трогает
-    return re.sub(r'^[^\w\s]+', '', text).strip()
-
-def check_user_access(user_id):
-    """Проверяет доступ пользователя к боту"""
-    try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Проверяем, является ли пользователь супер-админом
-        if user_id in ADMINS:
-            return True, "admin"
-        
-        # Проверяем статус пользователя в базе
-        c.execute("SELECT status FROM users WHERE user_id = %s", (user_id,))
-        result = c.fetchone()
-        
-        if result:
-            status = result[0]
-            if status == 'approved':
-                return True, "approved"
-            else:
-                return False, f"blocked ({status})"
-        else:
-            return False, "not_registered"
-            
-    except Exception as e:
-        print(f"Ошибка при проверке доступа пользователя {user_id}: {e}")
-        return False, "error"
-    finally:
-        if 'conn' in locals():
-            conn.close()
-
-
-def add_to_google_sheet(data):
-    print("🚨🚨🚨 ФУНКЦИЯ add_to_google_sheet ВЫЗВАНА! 🚨🚨🚨")
-    print(f"🚨🚨🚨 Данные: {data} 🚨🚨🚨")
-    try:
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet(SHEET_NAME)
-        # Jadval ustunlari: Kun, Summa, Nomi, Kirim-Chiqim, To'lov turi, Kategoriyalar, Izoh, Vaqt
-        from datetime import datetime
-        now = datetime.now()
-        # Формат даты: 7/30/2025
-        if platform.system() == 'Windows':
-            date_str = now.strftime('%-m/%-d/%Y')  # Убираем ведущие нули
-        else:
-            date_str = now.strftime('%-m/%-d/%Y')  # Убираем ведущие нули
-        time_str = now.strftime('%H:%M')
-        user_name = get_user_name(data.get('user_id', data.get('user_id', '')))
-        print(f"DEBUG: user_id = {data.get('user_id')}, user_name = '{user_name}'")
-        debug_users_table()  # Показываем содержимое базы данных
-        # Определяем, куда записать сумму в зависимости от выбранной валюты
-        currency = data.get('currency', 'Sum')
-        dollar_amount = ''
-        sum_amount = ''
-        
-        if currency == 'Dollar':
-            dollar_amount = data.get('amount', '')
-        else:
-            sum_amount = data.get('amount', '')
-        
-        row = [
-            date_str,      # Kun (A) - дата
-            time_str,      # Vaqt (B) - время
-            dollar_amount,                    # $ (C) - доллары
-            sum_amount,                       # Summa (D) - суммы
-            clean_emoji(data.get('type', '')), # Kirim-Chiqim (E)
-            data.get('pay_type', ''),         # To'lov turi (F)
-            clean_emoji(data.get('category', '')), # Kotegoriyalar (G)
-            '',                               # Loyihalar (H) - пусто
-            data.get('comment', ''),          # Izoh (I)
-            '',                               # Oylik ko'rsatkich (J) - пусто
-            user_name                         # User (K) - имя пользователя
-        ]
-        print(f"DEBUG: Row data: {row}")
-        worksheet.append_row(row)
-        print(f"✅ Данные успешно записаны в Google Sheets")
-        
-        # Получаем остатки из первой строки
-        try:
-            # Читаем значения из первой строки (C1 и D1)
-            dollar_balance = worksheet.acell('C1').value or '0'
-            sum_balance = worksheet.acell('D1').value or '0'
-            
-            # Форматируем остатки
-            balance_text = f"💰 <b>Остатки:</b>\n"
-            balance_text += f"💵 <b>Доллары:</b> {dollar_balance}\n"
-            balance_text += f"💸 <b>Суммы:</b> {sum_balance}"
-            
-            return balance_text
-        except Exception as e:
-            print(f"❌ Ошибка при получении остатков: {e}")
-            return None
-            
-    except Exception as e:
-        print(f"❌ Ошибка при записи в Google Sheets: {e}")
-        # Можно добавить логирование ошибки
-        return None
-
-def format_summary(data):
-    tur_emoji = '🟢' if data.get('type') == 'Kirim' else '🔴'
-    dt = data.get('dt', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    # Показываем категорию без эмодзи
-    category_name = data.get('category', '-')
-    currency = data.get('currency', 'Sum')
-    currency_symbol = '💵' if currency == 'Dollar' else '💸'
-    return (
-        f"<b>Natija:</b>\n"
-        f"<b>Tur:</b> {tur_emoji} {data.get('type', '-')}\n"
-        f"<b>Kotegoriya:</b> {category_name}\n"
-        f"<b>Valyuta:</b> {currency_symbol} {currency}\n"
-        f"<b>Summa:</b> {data.get('amount', '-')}\n"
-        f"<b>To'lov turi:</b> {data.get('pay_type', '-')}\n"
-        f"<b>Izoh:</b> {data.get('comment', '-')}\n"
-        f"<b>Vaqt:</b> {dt}"
-    )
-
-# --- Админы ---
-ADMINS = [5657091547, 5048593195]  # Здесь можно добавить id других админов через запятую
-
-# --- Инициализация БД ---
-def get_db_conn():
-    return psycopg2.connect(
-        dbname=env.str('POSTGRES_DB', 'kapital'),
-        user=env.str('POSTGRES_USER', 'postgres'),
-        password=env.str('POSTGRES_PASSWORD', 'postgres'),
-        host=env.str('POSTGRES_HOST', 'localhost'),
-        port=env.str('POSTGRES_PORT', '5432')
+async def add_to_google_sheet(data):
+    """
+    Записывает операцию в журнал transactions и возвращает её id.
+    В Google Sheets её отправит sheet_writer, результат придёт в notify_sheet_status.
+    """
+    now = datetime.now()
+    transaction_id = await db.add_transaction(
+        now.date(),
+        now.time().replace(microsecond=0),
+        parse_amount(data.get('amount', '')),
+        data.get('currency', 'Sum'),
+        clean_emoji(data.get('type', '')),
+        data.get('pay_type', ''),
+        clean_emoji(data.get('category', '')),
+        data.get('comment', ''),
+        data.get('user_id'),
     )
+    sheet_writer.notify()
+    return transaction_id
+
+async def notify_sheet_status(user_id, transaction_id, status, balances):
+    if status == 'sent':
+        text = "✅ Данные успешно записаны в Google Sheets"
+        if balances:
+            # Остатки из первой строки (C1 и D1), данные в лист по-прежнему вносятся и вручную
+            text += "\n\n💰 <b>Остатки:</b>\n"
+            text += "\n".join(f"<b>{label}:</b> {balances[cell]}" for cell, label in BALANCE_CELLS)
+    else:
+        text = "❌ Ошибка при записи в Google Sheets. Администратор проверит запись."
+    # Через общий лимит: пачка в конце месяца — это десятки сообщений подряд
+    await broadcaster.send(user_id, text)
 
-def init_db():
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        user_id BIGINT UNIQUE,
-        name TEXT,
-        phone TEXT,
-        status TEXT,
-        reg_date TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS pay_types (
-        id SERIAL PRIMARY KEY,
-        name TEXT UNIQUE
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS categories (
-        id SERIAL PRIMARY KEY,
-        name TEXT UNIQUE
-    )''')
-    # Заполняем дефолтные значения, если таблицы пусты
-    c.execute('SELECT COUNT(*) FROM pay_types')
-    if c.fetchone()[0] == 0:
-        for name in ["Plastik", "Naxt", "Perevod", "Bank"]:
-            c.execute('INSERT INTO pay_types (name) VALUES (%s)', (name,))
-    c.execute('SELECT COUNT(*) FROM categories')
-    if c.fetchone()[0] == 0:
-        for name in ["Мижозлардан", "Аренда техника и инструменты", "Бетон тайёрлаб бериш", "Геология ва лойиха ишлари", "Геология ишлари", "Диз топливо для техники", "Дорожные расходы", "Заправка", "Коммунал и интернет", "Кунлик ишчи", "Объем усталар", "Перевод", "Ойлик ишчилар", "Олиб чикиб кетилган мусор", "Перечесления Расход", "Питание", "Прочие расходы", "Ремонт техники и запчасти", "Сотиб олинган материал", "Карз", "Сотиб олинган снос уйлар", "Валюта операция", "Хизмат (Прочие расходы)", "Хоз товары и инвентарь", "SXF Kapital", "Хожи Ака", "Эхсон", "Хомийлик"]:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
-    conn.commit()
-    conn.close()
-
-init_db()
-
-# --- Проверка статуса пользователя ---
-def get_user_status(user_id):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT status FROM users WHERE user_id=%s', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-# --- Регистрация пользователя ---
-def register_user(user_id, name, phone):
-    from datetime import datetime
-    print(f"DEBUG: register_user called with user_id={user_id}, name='{name}', phone='{phone}'")
-    conn = get_db_conn()
-    c = conn.cursor()
-    try:
-        c.execute('INSERT INTO users (user_id, name, phone, status, reg_date) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (user_id) DO NOTHING',
-                  (user_id, name, phone, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        conn.commit()
-        print(f"DEBUG: User registered successfully in database")
-    except IntegrityError:
-        print(f"DEBUG: User already exists in database")
-        conn.rollback()
-    except Exception as e:
-        print(f"DEBUG: Error registering user: {e}")
-        conn.rollback()
-    conn.close()
-
-# --- Обновление статуса пользователя ---
-def update_user_status(user_id, status):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('UPDATE users SET status=%s WHERE user_id=%s', (status, user_id))
-    conn.commit()
-    conn.close()
-
-# --- Проверка содержимого базы данных ---
-def debug_users_table():
-    print("DEBUG: Checking users table contents:")
-    conn = get_db_conn()
-    c = conn.cursor()
-    try:
-        c.execute('SELECT user_id, name, phone, status, reg_date FROM users ORDER BY id DESC LIMIT 5')
-        rows = c.fetchall()
-        for row in rows:
-            print(f"  User: ID={row[0]}, Name='{row[1]}', Phone='{row[2]}', Status='{row[3]}', Date='{row[4]}'")
-    except Exception as e:
-        print(f"DEBUG: Error reading users table: {e}")
-    conn.close()
-
-# --- Получение имени пользователя для Google Sheets ---
-def get_user_name(user_id):
-    print(f"DEBUG: get_user_name called with user_id = {user_id}")
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT name FROM users WHERE user_id=%s', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    result = row[0] if row else ''
-    print(f"DEBUG: get_user_name result = '{result}'")
-    return result
-
-# --- Получение актуальных списков ---
-def get_pay_types():
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT name FROM pay_types')
-    result = [row[0] for row in c.fetchall()]
-    conn.close()
-    return result
-
-def get_categories():
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT name FROM categories')
-    result = [row[0] for row in c.fetchall()]
-    conn.close()
-    return result
+sheet_writer.on_status = notify_sheet_status
 
 # Удален старый обработчик /start с регистрацией
 
@@ -397,26 +117,14 @@ def get_categories():
 
 # Старт
 @dp.message_handler(commands=['start'])
-async def start(msg: types.Message, state: FSMContext):
+async def start(msg: types.Message, state: FSMContext, access: Access):
     await state.finish()
+    # Раз пользователь пишет боту, рассылки снова могут до него дойти
+    await db.set_bot_blocked(msg.from_user.id, False)
     
-    # Проверяем доступ пользователя
-    has_access, access_type = check_user_access(msg.from_user.id)
-    
-    if not has_access:
-        if access_type == "not_registered":
-            text = "❌ <b>Ruxsat yo'q!</b>\n\n"
-            text += "Siz botdan foydalanish uchun ro'yxatdan o'tishingiz kerak.\n"
-            text += "Ro'yxatdan o'tish uchun /register ni bosing"
-        elif "blocked" in access_type:
-            text = "❌ <b>Akkauntiz bloklangan!</b>\n\n"
-            text += "Sizning akkauntingiz admin tomonidan bloklangan.\n"
-            text += "Batafsil ma'lumot uchun admin bilan bog'laning: @usernamti"
-        else:
-            text = "❌ <b>Xatolik!</b>\n\n"
-            text += "Tizimda xatolik yuz berdi. Ro'yxatdan o'tish uchun /register ni bosing"
-        
-        await msg.answer(text)
+    # Команда публичная: доступ уже проверил SecurityMiddleware
+    if not access.allowed:
+        await msg.answer(access_denied_text(access.status))
         return
     
     # Создаем клавиатуру
@@ -432,22 +140,20 @@ async def start(msg: types.Message, state: FSMContext):
 
 # Команда регистрации
 @dp.message_handler(commands=['register'], state='*')
-async def register_cmd(msg: types.Message, state: FSMContext):
+async def register_cmd(msg: types.Message, state: FSMContext, access: Access):
     await state.finish()
     
     # Проверяем, не зарегистрирован ли уже пользователь
-    has_access, access_type = check_user_access(msg.from_user.id)
-    
-    if has_access:
+    if access.allowed:
         await msg.answer("✅ Siz allaqachon ro'yxatdan o'tgansiz!")
         return
     
-    if access_type == "not_registered":
+    if access.status == "not_registered":
         await msg.answer("📝 <b>Ro'yxatdan o'tish</b>\n\n"
                         "Ismingizni yuboring:")
         await Form.waiting_name.set()
     else:
-        await msg.answer(f"❌ Sizning hisobingiz {access_type} holatida. Admin bilan bog'laning.")
+        await msg.answer(f"❌ Sizning hisobingiz {access.status} holatida. Admin bilan bog'laning.")
 
 # Обработчик имени при регистрации
 @dp.message_handler(state=Form.waiting_name)
@@ -478,19 +184,7 @@ async def process_register_phone(msg: types.Message, state: FSMContext):
     
     try:
         # Добавляем пользователя в базу со статусом "pending"
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        c.execute("""
-            INSERT INTO users (user_id, name, phone, status, reg_date) 
-            VALUES (%s, %s, %s, 'pending', NOW())
-            ON CONFLICT (user_id) DO UPDATE SET
-            name = EXCLUDED.name,
-            phone = EXCLUDED.phone,
-            status = 'pending'
-        """, (msg.from_user.id, name, phone))
-        
-        conn.commit()
+        await db.save_registration(msg.from_user.id, name, phone)
         
         # Уведомляем админов
         await notify_admins_new_registration(msg.from_user.id, name, phone)
@@ -506,9 +200,6 @@ async def process_register_phone(msg: types.Message, state: FSMContext):
     except Exception as e:
         await msg.answer(f"❌ Xatolik yuz berdi: {e}")
         await state.finish()
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # Функция уведомления админов о новой регистрации
 async def notify_admins_new_registration(user_id, name, phone):
@@ -527,172 +218,78 @@ async def notify_admins_new_registration(user_id, name, phone):
     )
     
     # Отправляем всем админам
-    for admin_id in ADMINS:
-        try:
-            await bot.send_message(admin_id, text, reply_markup=keyboard)
-        except Exception as e:
-            print(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+    await broadcaster.broadcast(ADMINS, text, name='registration', reply_markup=keyboard)
 
 # Обработчики кнопок для админов
 @dp.callback_query_handler(lambda c: c.data.startswith('approve_'))
+@admin_only
 async def approve_user(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        await call.answer("Faqat admin uchun!")
-        return
-    
     user_id = int(call.data.split('_')[1])
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
         # Обновляем статус пользователя на "approved"
-        c.execute("UPDATE users SET status = 'approved' WHERE user_id = %s", (user_id,))
-        conn.commit()
+        await db.update_user_status(user_id, 'approved')
         
         # Уведомляем пользователя
-        try:
-            await bot.send_message(user_id, "✅ <b>Tabriklaymiz!</b>\n\n"
-                                           "Sizning hisobingiz tasdiqlandi!\n"
-                                           "Endi siz botdan to'liq foydalanish mumkin.")
-        except Exception as e:
-            print(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+        await broadcaster.send(user_id, "✅ <b>Tabriklaymiz!</b>\n\n"
+                                        "Sizning hisobingiz tasdiqlandi!\n"
+                                        "Endi siz botdan to'liq foydalanish mumkin.")
         
         await call.message.edit_text(f"✅ Foydalanuvchi tasdiqlandi: {user_id}")
         await call.answer()
         
     except Exception as e:
         await call.answer(f"Xatolik: {e}")
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 @dp.callback_query_handler(lambda c: c.data.startswith('reject_'))
+@admin_only
 async def reject_user(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        await call.answer("Faqat admin uchun!")
-        return
-    
     user_id = int(call.data.split('_')[1])
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
         # Обновляем статус пользователя на "rejected"
-        c.execute("UPDATE users SET status = 'rejected' WHERE user_id = %s", (user_id,))
-        conn.commit()
+        await db.update_user_status(user_id, 'rejected')
         
         # Уведомляем пользователя
-        try:
-            await bot.send_message(user_id, "❌ <b>Kechirasiz!</b>\n\n"
-                                           "Sizning so'rovingiz rad etildi.\n"
-                                           "Batafsil ma'lumot uchun admin bilan bog'laning.")
-        except Exception as e:
-            print(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+        await broadcaster.send(user_id, "❌ <b>Kechirasiz!</b>\n\n"
+                                        "Sizning so'rovingiz rad etildi.\n"
+                                        "Batafsil ma'lumot uchun admin bilan bog'laning.")
         
         await call.message.edit_text(f"❌ Foydalanuvchi rad etildi: {user_id}")
         await call.answer()
         
     except Exception as e:
         await call.answer(f"Xatolik: {e}")
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-# Обработчик для кнопки клавиатуры
+# Обработчик /all и кнопки клавиатуры
+async def all_report_page(page):
+    """Страница отчёта /all и кнопки перехода между страницами"""
+    # Итоги показываем из листа: данные по-прежнему вносятся прямо в него
+    text, page, pages = await all_report.render(page)
+    return text, page_kb('all_page_', page, pages)
+
+@dp.callback_query_handler(lambda c: c.data.startswith('all_page_'))
+@rate_limit(1, key='all_page', burst=3)
+async def all_page_cb(call: types.CallbackQuery):
+    try:
+        text, kb = await all_report_page(int(call.data[len('all_page_'):]))
+        await call.message.edit_text(text, reply_markup=kb)
+    except MessageNotModified:
+        pass
+    except Exception as e:
+        await call.answer(f"❌ Не удалось получить данные из Google Sheets: {e}", show_alert=True)
+        return
+    await call.answer()
+
+@dp.message_handler(commands=['all'], state='*')
 @dp.message_handler(lambda message: message.text == "📊 Barcha ma'lumotlar", state='*')
-async def keyboard_all_cmd(msg: types.Message, state: FSMContext):
+@rate_limit(5, key='all', burst=2)
+async def all_cmd(msg: types.Message, state: FSMContext):
     await state.finish()
     
-    # Проверяем доступ пользователя
-    has_access, access_type = check_user_access(msg.from_user.id)
-    
-    if not has_access:
-        if access_type == "not_registered":
-            text = "❌ <b>Ruxsat yo'q!</b>\n\n"
-            text += "Siz botdan foydalanish uchun ro'yxatdan o'tishingiz kerak.\n"
-            text += "Ro'yxatdan o'tish uchun /register ni bosing"
-        elif "blocked" in access_type:
-            text = "❌ <b>Akkauntiz bloklangan!</b>\n\n"
-            text += "Sizning akkauntingiz admin tomonidan bloklangan.\n"
-            text += "Batafsil ma'lumot uchun admin bilan bog'laning: @usernamti"
-        else:
-            text = "❌ <b>Xatolik!</b>\n\n"
-            text += "Tizimda xatolik yuz berdi. Ro'yxatdan o'tish uchun /register ni bosing"
-        
-        await msg.answer(text)
-        return
-    
     try:
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet(SHEET_NAME)
-        
-        # Получаем все данные
-        all_values = worksheet.get_all_values()
-        
-        # Получаем заголовки из 2-й строки (индекс 1)
-        headers = all_values[1] if len(all_values) > 1 else []
-        
-        # Берем только строки начиная с 3-й (индекс 2)
-        data_rows = all_values[2:] if len(all_values) > 2 else []
-        
-        # Фильтруем только строки с данными в первой колонке
-        data_rows = [row for row in data_rows if row and row[0]]
-        
-        # Формируем красивое сообщение
-        text = "📊 <b>SXF moliyaviy malumot</b>\n\n"
-        
-        # Столбцы которые нужно исключить
-        excluded_headers = [
-            "Som Kirim",
-            "Som chiqim", 
-            "Kirim $",
-            "Chiqim $",
-            "Bank kirim",
-            "Bank chiqim"
-        ]
-        
-        for i, row in enumerate(data_rows, 1):
-            # Показываем название компании
-            text += f"<b>{i}. {row[0] if row[0] else 'Не указано'}</b>\n"
-            
-            # Показываем все данные из строки с заголовками
-            for j, cell_value in enumerate(row[1:], 1):  # начиная со 2-го столбца
-                if cell_value:  # показываем только непустые ячейки
-                    # Получаем заголовок для этого столбца
-                    header = headers[j] if j < len(headers) else f"Столбец {j+1}"
-                    
-                    # Проверяем, не нужно ли исключить этот столбец
-                    if header not in excluded_headers:
-                        text += f"   <b>{header}:</b> {cell_value}\n"
-            
-            text += "\n"
-        
-        # Добавляем Umumiy qoldiq
-        try:
-            # Читаем значения из ячеек
-            d1_value = worksheet.acell('D1').value or '0'
-            g1_value = worksheet.acell('G1').value or '0'
-            j1_value = worksheet.acell('J1').value or '0'
-            m1_value = worksheet.acell('M1').value or '0'
-            n1_value = worksheet.acell('N1').value or '0'
-            o1_value = worksheet.acell('O1').value or '0'
-            
-            text += "💰 <b>Umumiy qoldiq</b>\n"
-            text += f"Ostatka Som : {d1_value}\n"
-            text += f"Ostatka $ : {g1_value}\n"
-            text += f"Ostatka Bank : {j1_value}\n"
-            text += f"Bugungi qarzdorlar : {m1_value}\n"
-            text += f"Umumiy Qarzdorlar : {n1_value}\n"
-            text += f"Mavjud Obektlar summasi : {o1_value}\n"
-            
-        except Exception as e:
-            text += "❌ Umumiy qoldiq ma'lumotlarini olishda xatolik\n"
-
-        await msg.answer(text)
+        text, kb = await all_report_page(1)
+        await msg.answer(text, reply_markup=kb)
         
     except FileNotFoundError:
         await msg.answer("❌ Файл credentials.json не найден. Проверьте настройки подключения.")
@@ -703,10 +300,8 @@ async def keyboard_all_cmd(msg: types.Message, state: FSMContext):
 
 # --- Команды для админа ---
 @dp.message_handler(commands=['add_tolov'], state='*')
+@admin_only
 async def add_paytype_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
     await msg.answer('Yangi To‘lov turi nomini yuboring:')
     await state.set_state('add_paytype')
@@ -714,92 +309,54 @@ async def add_paytype_cmd(msg: types.Message, state: FSMContext):
 @dp.message_handler(state='add_paytype', content_types=types.ContentTypes.TEXT)
 async def add_paytype_save(msg: types.Message, state: FSMContext):
     name = msg.text.strip()
-    conn = get_db_conn()
-    c = conn.cursor()
-    try:
-        c.execute('INSERT INTO pay_types (name) VALUES (%s)', (name,))
-        conn.commit()
+    if await db.add_pay_type(name):
         await msg.answer(f'✅ Yangi To‘lov turi qo‘shildi: {name}')
-    except IntegrityError:
+    else:
         await msg.answer('❗️ Bu nom allaqachon mavjud.')
-        conn.rollback()
-    conn.close()
     await state.finish()
 
 @dp.message_handler(commands=['add_category'], state='*')
+@admin_only
 async def add_category_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
     await msg.answer('Yangi kategoriya nomini yuboring:')
     await state.set_state('add_category')
 
-def split_emoji_and_text(text):
-    match = re.match(r'^([^ -\w\s]+)?\s*(.*)', text)
-    if match:
-        emoji = match.group(1) or ''
-        name = match.group(2)
-        return emoji, name
-    return '', text
-
 @dp.message_handler(state='add_category', content_types=types.ContentTypes.TEXT)
 async def add_category_save(msg: types.Message, state: FSMContext):
     emoji, name = split_emoji_and_text(msg.text.strip())
-    conn = get_db_conn()
-    c = conn.cursor()
-    try:
-        c.execute('INSERT INTO categories (name, emoji) VALUES (%s, %s)', (name, emoji))
-        conn.commit()
+    if await db.add_category(name, emoji):
         await msg.answer(f'✅ Yangi kategoriya qo‘shildi: {emoji} {name}'.strip())
-    except IntegrityError:
+    else:
         await msg.answer('❗️ Bu nom allaqachon mavjud.')
-        conn.rollback()
-    conn.close()
     await state.finish()
 
 # --- Удаление и изменение To'lov turi ---
 @dp.message_handler(commands=['del_tolov'], state='*')
+@admin_only
 async def del_tolov_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_pay_types():
-        kb.add(InlineKeyboardButton(f'❌ {name}', callback_data=f'del_tolov_{name}'))
+    kb = await pay_types_kb('del_tolov_', '❌ {}')
     await msg.answer('O‘chirish uchun To‘lov turini tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('del_tolov_'))
+@admin_only
 async def del_tolov_cb(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        await call.answer('Faqat admin uchun!', show_alert=True)
-        return
     name = call.data[len('del_tolov_'):]
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM pay_types WHERE name=%s', (name,))
-    conn.commit()
-    conn.close()
+    await db.delete_pay_type(name)
     await call.message.edit_text(f'❌ To‘lov turi o‘chirildi: {name}')
     await call.answer()
 
 @dp.message_handler(commands=['edit_tolov'], state='*')
+@admin_only
 async def edit_tolov_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_pay_types():
-        kb.add(InlineKeyboardButton(f'✏️ {name}', callback_data=f'edit_tolov_{name}'))
+    kb = await pay_types_kb('edit_tolov_', '✏️ {}')
     await msg.answer('Tahrirlash uchun To‘lov turini tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('edit_tolov_'))
+@admin_only
 async def edit_tolov_cb(call: types.CallbackQuery, state: FSMContext):
-    if call.from_user.id not in ADMINS:
-        await call.answer('Faqat admin uchun!', show_alert=True)
-        return
     old_name = call.data[len('edit_tolov_'):]
     await state.update_data(edit_tolov_old=old_name)
     await call.message.answer(f'Yangi nomini yuboring (eski: {old_name}):')
@@ -811,56 +368,36 @@ async def edit_tolov_save(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     old_name = data.get('edit_tolov_old')
     new_name = msg.text.strip()
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('UPDATE pay_types SET name=%s WHERE name=%s', (new_name, old_name))
-    conn.commit()
-    conn.close()
+    await db.rename_pay_type(old_name, new_name)
     await msg.answer(f'✏️ To‘lov turi o‘zgartirildi: {old_name} → {new_name}')
     await state.finish()
 
 # --- Удаление и изменение Kotegoriyalar ---
 @dp.message_handler(commands=['del_category'], state='*')
+@admin_only
 async def del_category_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_categories():
-        kb.add(InlineKeyboardButton(f'❌ {name}', callback_data=f'del_category_{name}'))
+    kb = await categories_kb('del_category_', '❌ {}')
     await msg.answer('O‘chirish uchun kategoriya tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('del_category_'))
+@admin_only
 async def del_category_cb(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        await call.answer('Faqat admin uchun!', show_alert=True)
-        return
     name = call.data[len('del_category_'):]
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM categories WHERE name=%s', (name,))
-    conn.commit()
-    conn.close()
+    await db.delete_category(name)
     await call.message.edit_text(f'❌ Kategoriya o‘chirildi: {name}')
     await call.answer()
 
 @dp.message_handler(commands=['edit_category'], state='*')
+@admin_only
 async def edit_category_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
-    kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_categories():
-        kb.add(InlineKeyboardButton(f'✏️ {name}', callback_data=f'edit_category_{name}'))
+    kb = await categories_kb('edit_category_', '✏️ {}')
     await msg.answer('Tahrirlash uchun kategoriya tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('edit_category_'))
+@admin_only
 async def edit_category_cb(call: types.CallbackQuery, state: FSMContext):
-    if call.from_user.id not in ADMINS:
-        await call.answer('Faqat admin uchun!', show_alert=True)
-        return
     old_name = call.data[len('edit_category_'):]
     await state.update_data(edit_category_old=old_name)
     await call.message.answer(f'Yangi nomini yuboring (eski: {old_name}):')
@@ -872,33 +409,18 @@ async def edit_category_save(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     old_name = data.get('edit_category_old')
     new_name = msg.text.strip()
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('UPDATE categories SET name=%s WHERE name=%s', (new_name, old_name))
-    conn.commit()
-    conn.close()
+    await db.rename_category(old_name, new_name)
     await msg.answer(f'✏️ Kategoriya o‘zgartirildi: {old_name} → {new_name}')
     await state.finish()
 
 @dp.message_handler(commands=['debug_db'], state='*')
+@admin_only
 async def debug_db_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
         # Проверяем таблицу users
-        c.execute("SELECT COUNT(*) FROM users")
-        users_count = c.fetchone()[0]
-        
-        c.execute("SELECT user_id, name, phone, status, reg_date FROM users ORDER BY id DESC LIMIT 5")
-        recent_users = c.fetchall()
-        
-        conn.close()
+        users_count, recent_users = await db.get_users_overview()
         
         text = f"<b>База данных:</b>\n"
         text += f"Всего пользователей: {users_count}\n\n"
@@ -915,15 +437,115 @@ async def debug_db_cmd(msg: types.Message, state: FSMContext):
     except Exception as e:
         await msg.answer(f"❌ Ошибка при проверке БД: {e}")
 
+@dp.message_handler(commands=['check_balances'], state='*')
+@admin_only
+async def check_balances_cmd(msg: types.Message, state: FSMContext):
+    """Сверка остатков журнала с листом; /check_balances fix переносит разницу в начальные остатки"""
+    await state.finish()
+    
+    try:
+        lag = (await sheet_writer.stats())['lag']
+        balances = await db.get_balances()
+        sheet_values = await run_blocking(read_cells, [(cell, label) for name, label, cell in BALANCE_LABELS])
+    except Exception as e:
+        await msg.answer(f"❌ Ошибка при сверке остатков: {e}")
+        return
+    
+    comparison = balances.compare(sheet_values)
+    labels = {name: (label, cell) for name, label, cell in BALANCE_LABELS}
+    text = "<b>Сверка остатков (журнал / лист):</b>\n"
+    for name, local, sheet, diff in comparison:
+        label, cell = labels[name]
+        sheet_text = format_amount(sheet) if sheet is not None else sheet_values.get(cell, '?')
+        diff_text = '✅' if diff == 0 else (f"разница {format_amount(diff)}" if diff is not None else '❓')
+        text += f"{label}: {format_amount(local)} / {sheet_text} — {diff_text}\n"
+    if lag:
+        text += f"\n⏳ Ещё не отправлено в лист операций: {lag}, сверка неточная"
+    
+    if msg.get_args().strip() == 'fix':
+        if lag:
+            await msg.answer(text + "\nДождитесь отправки операций и повторите /check_balances fix")
+            return
+        for name, local, sheet, diff in comparison:
+            if diff is not None:
+                await db.add_balance_opening(name, diff)
+        text += "\n✅ Разница перенесена в начальные остатки журнала"
+    await msg.answer(text)
+
+@dp.message_handler(commands=['io_stats'], state='*')
+@admin_only
+async def io_stats_cmd(msg: types.Message, state: FSMContext):
+    await state.finish()
+    
+    stats = blocking_io.stats()
+    text = "<b>Блокирующий ввод-вывод (БД и Google Sheets):</b>\n"
+    text += f"Потоков: {stats['workers']}\n"
+    text += f"В очереди: {stats['queued']} (максимум {stats['max_queued']})\n"
+    text += f"Выполняется: {stats['running']}\n"
+    text += f"Завершено: {stats['completed']}, с ошибкой: {stats['failed']}, по таймауту: {stats['timeouts']}\n\n"
+    
+    db_stats = pool.stats()
+    text += "<b>Пул соединений с БД:</b>\n"
+    text += f"Открыто: {db_stats['size']} (занято {db_stats['in_use']}, свободно {db_stats['idle']})\n"
+    text += f"Ожидают соединения: {db_stats['waiting']}\n"
+    text += f"Всего открыто: {db_stats['opened']}, закрыто: {db_stats['discarded']}\n\n"
+    
+    cache_stats = access_cache.stats()
+    text += "<b>Кеш доступа:</b>\n"
+    text += f"Записей: {cache_stats['size']}, попаданий: {cache_stats['hits']}, промахов: {cache_stats['misses']}\n"
+    listener_stats = cache_listener.stats()
+    text += f"LISTEN/NOTIFY: {'подключён' if listener_stats['connected'] else 'нет соединения'}, "
+    text += f"уведомлений: {listener_stats['received']}, переподключений: {listener_stats['reconnects']}\n"
+    fsm_stats = dp.storage.cache.stats()
+    text += f"Кеш FSM: записей {fsm_stats['size']}, попаданий {fsm_stats['hits']}, промахов {fsm_stats['misses']}\n\n"
+    
+    text += "<b>Запуск:</b>\n"
+    text += "".join(f"{name}: {seconds:.2f} с\n" for name, seconds in startup.timings.items())
+    for name, (seconds, error) in startup.tasks.items():
+        text += f"{name}: {seconds:.2f} с" + (f" (ошибка: {error})" if error else "") + "\n"
+    text += "\n"
+    
+    throttling_stats = throttling.stats()
+    text += "<b>Ограничение частоты:</b>\n"
+    text += f"Бакетов: {throttling_stats['buckets']}, отклонено: {throttling_stats['rejected']}, вытеснено: {throttling_stats['evicted']}\n\n"
+    
+    broadcast_stats = broadcaster.stats()
+    text += "<b>Рассылки:</b>\n"
+    text += "".join(f"{job}\n" for job in broadcast_stats['jobs'][-3:]) or "Рассылок не было\n"
+    text += f"Повторов отправки: {broadcast_stats['retried']}\n\n"
+    
+    flight_stats = user_reads.stats()
+    text += "<b>Объединение одинаковых запросов пользователей:</b>\n"
+    text += f"Запросов к БД: {flight_stats['calls']}, дождались чужого: {flight_stats['shared']}\n\n"
+    
+    writer_stats = await sheet_writer.stats()
+    text += "<b>Синхронизация журнала с Google Sheets:</b>\n"
+    text += f"Ожидают отправки: {writer_stats['lag']}\n"
+    text += f"Отправлено: {writer_stats['sent']}, повторов: {writer_stats['retried']}, с ошибкой: {writer_stats['failed']}"
+    await msg.answer(text)
+
+@dp.message_handler(commands=['debug_log'], state='*')
+@admin_only
+async def debug_log_cmd(msg: types.Message, state: FSMContext):
+    """/debug_log 0.1 — писать в лог 10% DEBUG-записей, /debug_log off — выключить"""
+    arg = msg.get_args().strip().lower()
+    try:
+        rate = 0.0 if arg in ('', 'off', '0') else float(arg)
+    except ValueError:
+        rate = -1
+    if not 0 <= rate <= 1:
+        await msg.answer("Использование: /debug_log <доля от 0 до 1> или /debug_log off")
+        return
+    set_debug_sample(rate)
+    await msg.answer(f"DEBUG-логи: {rate:.0%} записей" if rate else "DEBUG-логи выключены")
+
 @dp.message_handler(commands=['test_user'], state='*')
+@admin_only
 async def test_user_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()
     
     user_id = msg.from_user.id
-    user_name = get_user_name(user_id)
+    user_name = await db.get_user_name(user_id)
     
     text = f"<b>Тест функции get_user_name:</b>\n"
     text += f"Ваш user_id: {user_id}\n"
@@ -937,31 +559,13 @@ async def test_user_cmd(msg: types.Message, state: FSMContext):
     await msg.answer(text)
 
 @dp.message_handler(commands=['recreate_db'], state='*')
+@admin_only
 async def recreate_db_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Удаляем старую таблицу categories
-        c.execute('DROP TABLE IF EXISTS categories')
-        
-        # Создаем новую таблицу categories без столбца emoji
-        c.execute('''CREATE TABLE categories (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE
-        )''')
-        
-        # Заполняем дефолтными значениями
-        for name in ["Мижозлардан", "Аренда техника и инструменты", "Бетон тайёрлаб бериш", "Геология ва лойиха ишлари", "Геология ишлари", "Диз топливо для техники", "Дорожные расходы", "Заправка", "Коммунал и интернет", "Кунлик ишчи", "Объем усталар", "Перевод", "Ойлик ишчилар", "Олиб чикиб кетилган мусор", "Перечесления Расход", "Питание", "Прочие расходы", "Ремонт техники и запчасти", "Сотиб олинган материал", "Карз", "Сотиб олинган снос уйлар", "Валюта операция", "Хизмат (Прочие расходы)", "Хоз товары и инвентарь", "SXF Kapital", "Хожи Ака", "Эхсон", "Хомийлик"]:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
-        
-        conn.commit()
-        conn.close()
+        # Заполняем categories дефолтными значениями; схема и остальные таблицы не трогаются
+        await db.recreate_categories_table(DEFAULT_CATEGORIES)
         
         await msg.answer('✅ База данных пересоздана! Таблица categories обновлена.')
         
@@ -969,56 +573,13 @@ async def recreate_db_cmd(msg: types.Message, state: FSMContext):
         await msg.answer(f'❌ Ошибка при пересоздании БД: {e}')
 
 @dp.message_handler(commands=['sync_categories'], state='*')
+@admin_only
 async def sync_categories_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Очищаем таблицу categories
-        c.execute('DELETE FROM categories')
-        
-        # Добавляем актуальные категории
-        categories = [
-            "Мижозлардан",
-            "Аренда техника и инструменты",
-            "Бетон тайёрлаб бериш",
-            "Геология ва лойиха ишлари",
-            "Геология ишлари",
-            "Диз топливо для техники",
-            "Дорожные расходы",
-            "Заправка",
-            "Коммунал и интернет",
-            "Кунлик ишчи",
-            "Объем усталар",
-            "Перевод",
-            "Ойлик ишчилар",
-            "Олиб чикиб кетилган мусор",
-            "Перечесления Расход",
-            "Питание",
-            "Прочие расходы",
-            "Ремонт техники и запчасти",
-            "Сотиб олинган материал",
-            "Карз",
-            "Сотиб олинган снос уйлар",
-            "Валюта операция",
-            "Хизмат (Прочие расходы)",
-            "Хоз товары и инвентарь",
-            "SXF Kapital",
-            "Хожи Ака",
-            "Эхсон",
-            "Хомийлик"
-        ]
-        
-        for name in categories:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
-        
-        conn.commit()
-        conn.close()
+        # Очищаем таблицу categories и записываем список по умолчанию из миграций
+        await db.replace_categories(DEFAULT_CATEGORIES)
         
         await msg.answer('✅ Категории синхронизированы!')
         
@@ -1026,23 +587,16 @@ async def sync_categories_cmd(msg: types.Message, state: FSMContext):
         await msg.answer(f'❌ Ошибка при синхронизации: {e}')
 
 @dp.message_handler(commands=['show_categories'], state='*')
+@admin_only
 async def show_categories_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()
     
     try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        c.execute('SELECT name FROM categories ORDER BY id')
-        categories = c.fetchall()
-        conn.close()
+        categories = await db.get_categories()
         
         if categories:
             text = '<b>Текущие категории в базе данных:</b>\n\n'
-            for i, (name,) in enumerate(categories, 1):
+            for i, name in enumerate(categories, 1):
                 text += f"{i}. {name}\n"
         else:
             text = '❌ Категории не найдены в базе данных'
@@ -1053,10 +607,8 @@ async def show_categories_cmd(msg: types.Message, state: FSMContext):
         await msg.answer(f'❌ Ошибка при получении категорий: {e}')
 
 @dp.message_handler(commands=['load_categories_from_file'], state='*')
+@admin_only
 async def load_categories_from_file_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()
     
     try:
@@ -1064,18 +616,8 @@ async def load_categories_from_file_cmd(msg: types.Message, state: FSMContext):
         with open('categories.txt', 'r', encoding='utf-8') as f:
             categories = [line.strip() for line in f if line.strip()]
         
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Очищаем таблицу categories
-        c.execute('DELETE FROM categories')
-        
-        # Добавляем категории из файла
-        for name in categories:
-            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
-        
-        conn.commit()
-        conn.close()
+        # Очищаем таблицу categories и добавляем категории из файла
+        await db.replace_categories(categories)
         
         await msg.answer(f'✅ Загружено {len(categories)} категорий из файла categories.txt')
         
@@ -1085,127 +627,10 @@ async def load_categories_from_file_cmd(msg: types.Message, state: FSMContext):
         await msg.answer(f'❌ Ошибка при загрузке категорий: {e}')
 
 
-@dp.message_handler(commands=['all'], state='*')
-async def all_cmd(msg: types.Message, state: FSMContext):
-    await state.finish()
-    
-    # Проверяем доступ пользователя
-    has_access, access_type = check_user_access(msg.from_user.id)
-    
-    if not has_access:
-        if access_type == "not_registered":
-            text = "❌ <b>Ruxsat yo'q!</b>\n\n"
-            text += "Siz botdan foydalanish uchun ro'yxatdan o'tishingiz kerak.\n"
-            text += "Ro'yxatdan o'tish uchun /register ni bosing"
-        elif "blocked" in access_type:
-            text = "❌ <b>Akkauntiz bloklangan!</b>\n\n"
-            text += "Sizning akkauntingiz admin tomonidan bloklangan.\n"
-            text += "Batafsil ma'lumot uchun admin bilan bog'laning: @usernamti"
-        else:
-            text = "❌ <b>Xatolik!</b>\n\n"
-            text += "Tizimda xatolik yuz berdi. Ro'yxatdan o'tish uchun /register ni bosing"
-        
-        await msg.answer(text)
-        return
-    
-    try:
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        worksheet = sh.worksheet(SHEET_NAME)
-        
-        # Получаем все данные
-        all_values = worksheet.get_all_values()
-        
-        # Получаем заголовки из 2-й строки (индекс 1)
-        headers = all_values[1] if len(all_values) > 1 else []
-        
-        # Берем только строки начиная с 3-й (индекс 2)
-        data_rows = all_values[2:] if len(all_values) > 2 else []
-        
-        # Фильтруем только строки с данными в первой колонке
-        data_rows = [row for row in data_rows if row and row[0]]
-        
-        # Формируем красивое сообщение
-        text = "📊 <b>SXF moliyaviy malumot</b>\n\n"
-        
-        # Столбцы которые нужно исключить
-        excluded_headers = [
-            "Som Kirim",
-            "Som chiqim", 
-            "Kirim $",
-            "Chiqim $",
-            "Bank kirim",
-            "Bank chiqim"
-        ]
-        
-        for i, row in enumerate(data_rows, 1):
-            # Показываем название компании
-            text += f"<b>{i}. {row[0] if row[0] else 'Не указано'}</b>\n"
-            
-            # Показываем все данные из строки с заголовками
-            for j, cell_value in enumerate(row[1:], 1):  # начиная со 2-го столбца
-                if cell_value:  # показываем только непустые ячейки
-                    # Получаем заголовок для этого столбца
-                    header = headers[j] if j < len(headers) else f"Столбец {j+1}"
-                    
-                    # Проверяем, не нужно ли исключить этот столбец
-                    if header not in excluded_headers:
-                        text += f"   <b>{header}:</b> {cell_value}\n"
-            
-            text += "\n"
-        
-        # Добавляем Umumiy qoldiq
-        try:
-            # Читаем значения из ячеек
-            d1_value = worksheet.acell('D1').value or '0'
-            g1_value = worksheet.acell('G1').value or '0'
-            j1_value = worksheet.acell('J1').value or '0'
-            m1_value = worksheet.acell('M1').value or '0'
-            n1_value = worksheet.acell('N1').value or '0'
-            o1_value = worksheet.acell('O1').value or '0'
-            
-            text += "💰 <b>Umumiy qoldiq</b>\n"
-            text += f"Ostatka Som : {d1_value}\n"
-            text += f"Ostatka $ : {g1_value}\n"
-            text += f"Ostatka Bank : {j1_value}\n"
-            text += f"Bugungi qarzdorlar : {m1_value}\n"
-            text += f"Umumiy Qarzdorlar : {n1_value}\n"
-            text += f"Mavjud Obektlar summasi : {o1_value}\n"
-            
-        except Exception as e:
-            text += "❌ Umumiy qoldiq ma'lumotlarini olishda xatolik\n"
-        
-        await msg.answer(text)
-        
-    except FileNotFoundError:
-        await msg.answer("❌ Файл credentials.json не найден. Проверьте настройки подключения.")
-    except Exception as e:
-        await msg.answer(f"❌ Не удалось получить данные из Google Sheets: {e}")
-
-
 @dp.message_handler(commands=['reboot'], state='*')
 async def reboot_cmd(msg: types.Message, state: FSMContext):
     await state.finish()  # Останавливаем FSM состояние
     
-    # Проверяем доступ пользователя
-    has_access, access_type = check_user_access(msg.from_user.id)
-    
-    if not has_access:
-        if access_type == "not_registered":
-            text = "❌ <b>Ruxsat yo'q!</b>\n\n"
-            text += "Siz botdan foydalanish uchun ro'yxatdan o'tishingiz kerak.\n"
-            text += "Ro'yxatdan o'tish uchun /register ni bosing"
-        elif "blocked" in access_type:
-            text = "❌ <b>Akkauntiz bloklangan!</b>\n\n"
-            text += "Sizning akkauntingiz admin tomonidan bloklangan.\n"
-            text += "Batafsil ma'lumot uchun admin bilan bog'laning: @usernamti"
-        else:
-            text = "❌ <b>Xatolik!</b>\n\n"
-            text += "Tizimda xatolik yuz berdi. Ro'yxatdan o'tish uchun /register ni bosing"
-        
-        await msg.answer(text)
-        return
     
     # Создаем клавиатуру
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=False)
@@ -1219,11 +644,8 @@ async def reboot_cmd(msg: types.Message, state: FSMContext):
 
 # Команда для регистрации новых пользователей (только для админов)
 @dp.message_handler(commands=['add_user'], state='*')
+@admin_only
 async def add_user_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
-    
     # Парсим команду: /add_user user_id name phone
     try:
         parts = msg.text.split(' ', 3)
@@ -1237,23 +659,11 @@ async def add_user_cmd(msg: types.Message, state: FSMContext):
         name = parts[2]
         phone = parts[3]
         
-        # Добавляем пользователя в базу
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # Проверяем, существует ли пользователь
-        c.execute("SELECT user_id FROM users WHERE user_id = %s", (user_id,))
-        if c.fetchone():
+        # Добавляем пользователя в базу, если его там ещё нет
+        if not await db.add_approved_user(user_id, name, phone):
             await msg.answer(f'❌ Foydalanuvchi {user_id} allaqachon mavjud!')
             return
         
-        # Добавляем нового пользователя
-        c.execute("""
-            INSERT INTO users (user_id, name, phone, status, reg_date) 
-            VALUES (%s, %s, %s, 'approved', NOW())
-        """, (user_id, name, phone))
-        
-        conn.commit()
         await msg.answer(f'✅ Foydalanuvchi muvaffaqiyatli qo\'shildi!\n\n'
                         f'ID: {user_id}\n'
                         f'Ism: {name}\n'
@@ -1264,22 +674,13 @@ async def add_user_cmd(msg: types.Message, state: FSMContext):
         await msg.answer('❌ User ID raqam bo\'lishi kerak!')
     except Exception as e:
         await msg.answer(f'❌ Xatolik: {e}')
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 # Команда для просмотра заявок на регистрацию
 @dp.message_handler(commands=['pending_users'], state='*')
+@admin_only
 async def pending_users_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
-    
     await state.finish()
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name, phone, reg_date FROM users WHERE status='pending' ORDER BY reg_date DESC")
-    rows = c.fetchall()
+    rows = await db.list_users('pending')
     
     if not rows:
         await msg.answer('⏳ Hali birorta ham kutilayotgan so\'rov yo\'q.')
@@ -1295,16 +696,10 @@ async def pending_users_cmd(msg: types.Message, state: FSMContext):
     await msg.answer(text)
 
 @dp.message_handler(commands=['userslist'], state='*')
+@admin_only
 async def users_list_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name, phone, reg_date FROM users WHERE status='approved'")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.list_users('approved')
     if not rows:
         await msg.answer('Hali birorta ham tasdiqlangan foydalanuvchi yo‘q.')
         return
@@ -1314,68 +709,46 @@ async def users_list_cmd(msg: types.Message, state: FSMContext):
     await msg.answer(text)
 
 @dp.message_handler(commands=['block_user'], state='*')
+@admin_only
 async def block_user_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name FROM users WHERE status='approved'")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.list_users('approved')
     if not rows:
         await msg.answer('Hali birorta ham tasdiqlangan foydalanuvchi yo‘q.')
         return
     kb = InlineKeyboardMarkup(row_width=1)
-    for user_id, name in rows:
+    for user_id, name, phone, reg_date in rows:
         kb.add(InlineKeyboardButton(f'🚫 {name} ({user_id})', callback_data=f'blockuser_{user_id}'))
     await msg.answer('Bloklash uchun foydalanuvchini tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('blockuser_'))
+@admin_only
 async def block_user_cb(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        await call.answer('Faqat admin uchun!', show_alert=True)
-        return
     user_id = int(call.data[len('blockuser_'):])
-    update_user_status(user_id, 'denied')
-    try:
-        await bot.send_message(user_id, '❌ Sizga botdan foydalanishga ruxsat berilmagan. (Admin tomonidan bloklandi)')
-    except Exception:
-        pass
+    await db.update_user_status(user_id, 'denied')
+    await broadcaster.send(user_id, '❌ Sizga botdan foydalanishga ruxsat berilmagan. (Admin tomonidan bloklandi)')
     await call.message.edit_text(f'🚫 Foydalanuvchi bloklandi: {user_id}')
     await call.answer()
 
 @dp.message_handler(commands=['approve_user'], state='*')
+@admin_only
 async def approve_user_cmd(msg: types.Message, state: FSMContext):
-    if msg.from_user.id not in ADMINS:
-        await msg.answer('Faqat admin uchun!')
-        return
     await state.finish()  # Сброс состояния
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id, name FROM users WHERE status='denied'")
-    rows = c.fetchall()
-    conn.close()
+    rows = await db.list_users('denied')
     if not rows:
         await msg.answer('Hali birorta ham bloklangan foydalanuvchi yo‘q.')
         return
     kb = InlineKeyboardMarkup(row_width=1)
-    for user_id, name in rows:
+    for user_id, name, phone, reg_date in rows:
         kb.add(InlineKeyboardButton(f'✅ {name} ({user_id})', callback_data=f'approveuser_{user_id}'))
     await msg.answer('Qayta tasdiqlash uchun foydalanuvchini tanlang:', reply_markup=kb)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('approveuser_'))
+@admin_only
 async def approve_user_cb(call: types.CallbackQuery):
-    if call.from_user.id not in ADMINS:
-        await call.answer('Faqat admin uchun!', show_alert=True)
-        return
     user_id = int(call.data[len('approveuser_'):])
-    update_user_status(user_id, 'approved')
-    try:
-        await bot.send_message(user_id, '✅ Sizga botdan foydalanishga yana ruxsat berildi! /start')
-    except Exception:
-        pass
+    await db.update_user_status(user_id, 'approved')
+    await broadcaster.send(user_id, '✅ Sizga botdan foydalanishga yana ruxsat berildi! /start')
     await call.message.edit_text(f'✅ Foydalanuvchi qayta tasdiqlandi: {user_id}')
     await call.answer()
 
@@ -1389,20 +762,60 @@ async def set_user_commands(dp):
     await dp.bot.set_my_commands(commands)
 
 async def notify_all_users(bot):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users WHERE status='approved'")
-    rows = c.fetchall()
-    conn.close()
-    for (user_id,) in rows:
-        try:
-            await bot.send_message(user_id, "Iltimos, /start ni bosing va botdan foydalanishni davom eting!")
-        except Exception:
-            pass  # Пользователь мог заблокировать бота или быть недоступен
+    # При перезапусках подряд (restart: always) пользователи получают сообщение один раз
+    if not await db.claim_event('restart_broadcast', STARTUP_BROADCAST_COOLDOWN):
+        logging.info("Рассылка после перезапуска уже была недавно, пропускаем")
+        return
+    # Заблокировавших бота пропускаем: broadcaster отмечает их при первой неудачной отправке
+    user_ids = await db.list_reachable_user_ids('approved')
+    await broadcaster.broadcast(user_ids, "Iltimos, /start ni bosing va botdan foydalanishni davom eting!", name='restart')
+
+startup.mark('handlers')
+
+
+async def on_startup(dp):
+    # Схема БД создаётся при запуске, а не при импорте модуля
+    await run_blocking(migrate)
+    startup.mark('db_schema')
+    await metrics_server.start()
+    cache_listener.start()
+    dashboard.start()
+    sheet_writer.start()
+    dp.storage.start()
+    # Медленное — после того, как бот начал принимать апдейты
+    startup.background('set_user_commands', set_user_commands(dp))
+    startup.background('notify_all_users', notify_all_users(dp.bot))
+    startup.mark('ready')
+
+
+async def on_shutdown(dp):
+    await startup.cancel()
+    cache_listener.stop()
+    dashboard.stop()
+    await sheet_writer.stop()
+    await db.close()
+    await metrics_server.stop()
+
+
+async def on_startup_polling(dp):
+    # getUpdates не работает, пока у бота зарегистрирован вебхук
+    await dp.bot.delete_webhook()
+    await on_startup(dp)
+
+
+def main(mode=BOT_MODE):
+    """
+    Запускает бота. Импорт bot.py не подключается к БД и Google Sheets и не трогает
+    логирование: схема создаётся и фоновые службы стартуют только здесь, в on_startup.
+    """
+    setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_DEBUG_SAMPLE)
+    if mode == 'webhook':
+        from utils.misc.webhook import start_webhook
+        start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup_polling, on_shutdown=on_shutdown)
+
 
 if __name__ == '__main__':
-    from aiogram import executor
-    async def on_startup(dp):
-        await set_user_commands(dp)
-        await notify_all_users(dp.bot)
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup) 
+    main()
+
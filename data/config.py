@@ -0,0 +1,115 @@
+from environs import Env
+
+# Загрузка переменных окружения
+env = Env()
+env.read_env()
+
+# --- Админы ---
+ADMINS = [5657091547, 5048593195]  # Здесь можно добавить id других админов через запятую
+
+# --- Google Sheets settings ---
+SHEET_ID = '10KP00nakL0LK9lyB7jQrfUtmtIQO6gzqJDP0rogTEww'
+SHEET_NAME = 'Dashboard1'
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+CREDENTIALS_FILE = 'credentials.json'
+# За сколько секунд до истечения токена обновлять его заранее
+SHEETS_TOKEN_REFRESH_MARGIN = env.int('SHEETS_TOKEN_REFRESH_MARGIN', 300)
+# Таймаут HTTP-запросов gspread: ограничивает сам поток, а не только ожидание результата
+SHEETS_HTTP_TIMEOUT = env.float('SHEETS_HTTP_TIMEOUT', 60)
+
+# --- Блокирующий ввод-вывод (Postgres, Google Sheets) ---
+# Количество потоков для блокирующих вызовов и таймаут одного вызова в секундах
+IO_WORKERS = env.int('IO_WORKERS', 8)
+IO_TIMEOUT = env.float('IO_TIMEOUT', 30)
+
+# --- PostgreSQL ---
+DB_SETTINGS = dict(
+    dbname=env.str('POSTGRES_DB', 'kapital'),
+    user=env.str('POSTGRES_USER', 'postgres'),
+    password=env.str('POSTGRES_PASSWORD', 'postgres'),
+    host=env.str('POSTGRES_HOST', 'localhost'),
+    port=env.str('POSTGRES_PORT', '5432'),
+)
+# Пул соединений: размеры, время жизни соединения, простой до закрытия,
+# простой до проверки SELECT 1 и ожидание свободного соединения (секунды)
+DB_POOL_MIN = env.int('DB_POOL_MIN', 1)
+DB_POOL_MAX = env.int('DB_POOL_MAX', 10)
+DB_POOL_MAX_LIFETIME = env.int('DB_POOL_MAX_LIFETIME', 3600)
+DB_POOL_MAX_IDLE = env.int('DB_POOL_MAX_IDLE', 300)
+DB_POOL_HEALTH_CHECK_AFTER = env.int('DB_POOL_HEALTH_CHECK_AFTER', 30)
+DB_POOL_TIMEOUT = env.float('DB_POOL_TIMEOUT', 10)
+# Драйвер для запросов из хендлеров: psycopg2 (в пуле потоков) или asyncpg (нативно в asyncio)
+DB_BACKEND = env.str('DB_BACKEND', 'psycopg2')
+
+# --- Кеш решений о доступе (check_user_access) ---
+ACCESS_CACHE_SIZE = env.int('ACCESS_CACHE_SIZE', 1024)
+# Изменения users приходят через LISTEN/NOTIFY (utils/db_api/listener.py), TTL — страховка
+ACCESS_CACHE_TTL = env.int('ACCESS_CACHE_TTL', 3600)
+
+# --- Снимок Dashboard1 для /all ---
+# Как часто (секунды) фоново перечитывать лист; более старый снимок при запросе обновляется в фоне
+DASHBOARD_REFRESH_INTERVAL = env.int('DASHBOARD_REFRESH_INTERVAL', 60)
+
+# --- Синхронизация журнала transactions с Google Sheets ---
+# Сколько строк отправлять одним append_rows и сколько секунд строка может ждать отправки
+SHEETS_WRITE_BATCH_SIZE = env.int('SHEETS_WRITE_BATCH_SIZE', 50)
+SHEETS_WRITE_MAX_DELAY = env.float('SHEETS_WRITE_MAX_DELAY', 5)
+# Повторы при 429/5xx: число попыток и экспоненциальная пауза между ними (секунды)
+SHEETS_WRITE_MAX_ATTEMPTS = env.int('SHEETS_WRITE_MAX_ATTEMPTS', 8)
+SHEETS_WRITE_BACKOFF_BASE = env.float('SHEETS_WRITE_BACKOFF_BASE', 2)
+SHEETS_WRITE_BACKOFF_MAX = env.float('SHEETS_WRITE_BACKOFF_MAX', 300)
+
+# --- Состояния FSM (таблица fsm_states) ---
+# Сколько секунд живёт незаконченный сценарий и как часто удалять просроченные
+FSM_STATE_TTL = env.int('FSM_STATE_TTL', 86400)
+FSM_CLEANUP_INTERVAL = env.int('FSM_CLEANUP_INTERVAL', 3600)
+
+# --- Режим получения апдейтов: polling или webhook ---
+BOT_MODE = env.str('BOT_MODE', 'polling')
+# Кеш состояний FSM в процессе: сколько секунд верить прочитанному из БД; 0 — читать каждый раз.
+# В polling работает один процесс, а в webhook апдейты пользователя могут попасть в разные реплики,
+# поэтому там по умолчанию кеша нет
+FSM_CACHE_TTL = env.int('FSM_CACHE_TTL', 0 if BOT_MODE == 'webhook' else 300)
+FSM_CACHE_SIZE = env.int('FSM_CACHE_SIZE', 10000)
+# Публичный адрес за reverse proxy (https://bot.example.com) и путь вебхука
+WEBHOOK_HOST = env.str('WEBHOOK_HOST', '')
+WEBHOOK_PATH = env.str('WEBHOOK_PATH', '/webhook')
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; пустой — выводится из токена бота
+WEBHOOK_SECRET = env.str('WEBHOOK_SECRET', '')
+# Где слушает локальный aiohttp-сервер
+WEBAPP_HOST = env.str('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = env.int('WEBAPP_PORT', 8080)
+# Сколько соединений открывает Telegram и сколько апдейтов обрабатывается одновременно
+WEBHOOK_MAX_CONNECTIONS = env.int('WEBHOOK_MAX_CONNECTIONS', 40)
+WEBHOOK_MAX_CONCURRENCY = env.int('WEBHOOK_MAX_CONCURRENCY', 20)
+
+# --- Рассылки (уведомления пользователям и админам) ---
+# Лимит Telegram около 30 сообщений в секунду на бота; держимся ниже
+BROADCAST_RATE = env.float('BROADCAST_RATE', 25)
+BROADCAST_WORKERS = env.int('BROADCAST_WORKERS', 8)
+BROADCAST_MAX_RETRIES = env.int('BROADCAST_MAX_RETRIES', 3)
+
+# --- Запуск ---
+# Рассылка "нажмите /start" после перезапуска не чаще раза за столько секунд
+STARTUP_BROADCAST_COOLDOWN = env.int('STARTUP_BROADCAST_COOLDOWN', 21600)
+
+# --- Ограничение частоты запросов (middlewares/throttling.py) ---
+# Общий лимит пользователя (проверяется до фильтров): один запрос в THROTTLING_RATE_LIMIT
+# секунд, до THROTTLING_BURST подряд; обработчики с @rate_limit добавляют свой лимит
+THROTTLING_RATE_LIMIT = env.float('THROTTLING_RATE_LIMIT', 0.5)
+THROTTLING_BURST = env.int('THROTTLING_BURST', 3)
+# Сколько бакетов (пользователь, обработчик) помнить; самые давние вытесняются
+THROTTLING_MAX_BUCKETS = env.int('THROTTLING_MAX_BUCKETS', 10000)
+
+# --- Логирование (utils/misc/logging.py) ---
+LOG_LEVEL = env.str('LOG_LEVEL', 'INFO')
+# text или json (по строке JSON на запись)
+LOG_FORMAT = env.str('LOG_FORMAT', 'text')
+# Доля DEBUG-записей, попадающих в лог при LOG_LEVEL выше DEBUG (0 — ни одной)
+LOG_DEBUG_SAMPLE = env.float('LOG_DEBUG_SAMPLE', 0.0)
+
+# --- Метрики Prometheus (utils/misc/metrics.py) ---
+# Отдельный порт для GET /metrics без авторизации; по умолчанию 0 — сервер не поднимается.
+# Слушает только localhost, если явно не задан METRICS_HOST
+METRICS_HOST = env.str('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = env.int('METRICS_PORT', 0)
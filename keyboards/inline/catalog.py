@@ -0,0 +1,26 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from utils.db_api.database import categories_catalog, pay_types_catalog
+
+
+def catalog_kb(names, callback_prefix, label='{}', row_width=1):
+    kb = InlineKeyboardMarkup(row_width=row_width)
+    for name in names:
+        kb.add(InlineKeyboardButton(label.format(name), callback_data=f'{callback_prefix}{name}'))
+    return kb
+
+
+async def categories_kb(callback_prefix='cat_', label='{}', row_width=1):
+    """Клавиатура категорий; собирается один раз на версию справочника"""
+    return await categories_catalog.memoize(
+        (callback_prefix, label, row_width),
+        lambda names: catalog_kb(names, callback_prefix, label, row_width),
+    )
+
+
+async def pay_types_kb(callback_prefix='pay_', label='{}', row_width=1):
+    """Клавиатура To'lov turi; собирается один раз на версию справочника"""
+    return await pay_types_catalog.memoize(
+        (callback_prefix, label, row_width),
+        lambda names: catalog_kb(names, callback_prefix, label, row_width),
+    )
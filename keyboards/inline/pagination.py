@@ -0,0 +1,16 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+def page_kb(callback_prefix, page, pages):
+    """Кнопки ⬅️ / ➡️ для многостраничного сообщения; None, если страница одна"""
+    if pages <= 1:
+        return None
+    kb = InlineKeyboardMarkup(row_width=3)
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton('⬅️', callback_data=f'{callback_prefix}{page - 1}'))
+    buttons.append(InlineKeyboardButton(f'{page}/{pages}', callback_data=f'{callback_prefix}{page}'))
+    if page < pages:
+        buttons.append(InlineKeyboardButton('➡️', callback_data=f'{callback_prefix}{page + 1}'))
+    kb.row(*buttons)
+    return kb
@@ -1,10 +1,3 @@
-from aiogram import Dispatcher
-
-from loader import dp
 from .throttling import ThrottlingMiddleware
-from .support_middleware import SupportMiddleware
-
-
-if __name__ == "middlewares":
-    dp.middleware.setup(ThrottlingMiddleware())
-    dp.middleware.setup(SupportMiddleware())
+from .security_middleware import SecurityMiddleware
+from .metrics import MetricsMiddleware
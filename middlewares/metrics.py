@@ -0,0 +1,51 @@
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.misc.metrics import gauge, histogram
+
+UPDATES_IN_PROGRESS = gauge('bot_updates_in_progress', 'Апдейты, которые сейчас обрабатываются')
+UPDATE_SECONDS = histogram('bot_update_seconds', 'Полное время обработки апдейта')
+HANDLER_SECONDS = histogram('bot_handler_seconds', 'Время обработчика вместе с middleware после фильтров', ['handler'])
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Метрики обработки апдейтов для /metrics.
+
+    Считает апдейты в работе (глубину очереди обработки), полное время апдейта и время
+    по обработчикам. Время обработчика отсчитывается с on_process_*, где уже известен
+    обработчик, и до on_post_process_*.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        UPDATES_IN_PROGRESS.inc()
+        data['metrics_started'] = time.monotonic()
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        UPDATES_IN_PROGRESS.dec()
+        UPDATE_SECONDS.observe(time.monotonic() - data['metrics_started'])
+
+    @staticmethod
+    def _start_handler(data):
+        data['metrics_handler'] = current_handler.get().__name__
+        data['metrics_handler_started'] = time.monotonic()
+
+    @staticmethod
+    def _observe_handler(data):
+        if 'metrics_handler' in data:
+            HANDLER_SECONDS.observe(time.monotonic() - data['metrics_handler_started'], handler=data['metrics_handler'])
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._start_handler(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self._observe_handler(data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        self._start_handler(data)
+
+    async def on_post_process_callback_query(self, call: types.CallbackQuery, results, data: dict):
+        self._observe_handler(data)
@@ -0,0 +1,100 @@
+from aiogram import types, Dispatcher
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.db_api.database import db
+
+ADMIN_ONLY_TEXT = 'Faqat admin uchun!'
+
+
+class Access:
+    """Результат проверки доступа, доступен обработчикам как аргумент access"""
+
+    def __init__(self, user_id, allowed, status):
+        self.user_id = user_id
+        self.allowed = allowed
+        # admin, approved, not_registered, blocked (<статус>) или error
+        self.status = status
+
+    @property
+    def is_admin(self):
+        return self.status == 'admin'
+
+
+def access_denied_text(status):
+    if status == "not_registered":
+        text = "❌ <b>Ruxsat yo'q!</b>\n\n"
+        text += "Siz botdan foydalanish uchun ro'yxatdan o'tishingiz kerak.\n"
+        text += "Ro'yxatdan o'tish uchun /register ni bosing"
+    elif "blocked" in status:
+        text = "❌ <b>Akkauntiz bloklangan!</b>\n\n"
+        text += "Sizning akkauntingiz admin tomonidan bloklangan.\n"
+        text += "Batafsil ma'lumot uchun admin bilan bog'laning: @usernamti"
+    else:
+        text = "❌ <b>Xatolik!</b>\n\n"
+        text += "Tizimda xatolik yuz berdi. Ro'yxatdan o'tish uchun /register ni bosing"
+    return text
+
+
+class SecurityMiddleware(BaseMiddleware):
+    """
+    Единая проверка доступа к боту.
+
+    Доступ пользователя проверяется один раз на апдейт, в on_pre_process, то есть ещё до
+    фильтров и поиска обработчика. Результат (Access) кладётся в data['access'].
+    Пользователь без доступа дальше не проходит. Исключения: команды из public_commands
+    и состояния из public_states, через которые идёт регистрация.
+    Обработчики с @admin_only в on_process пропускаются только для админов.
+    """
+
+    def __init__(self, public_commands=('start', 'register'), public_states=()):
+        self.public_commands = set(public_commands)
+        self.public_states = set(public_states)
+        self.denied = 0
+        super(SecurityMiddleware, self).__init__()
+
+    @staticmethod
+    async def _resolve(user_id, data):
+        allowed, status = await db.check_user_access(user_id)
+        data['access'] = access = Access(user_id, allowed, status)
+        return access
+
+    async def _is_public(self, message: types.Message):
+        if message.is_command() and message.get_command(pure=True) in self.public_commands:
+            return True
+        if self.public_states:
+            # Состояние читаем только для пользователей без доступа
+            state = Dispatcher.get_current().current_state(chat=message.chat.id, user=message.from_user.id)
+            return await state.get_state() in self.public_states
+        return False
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        access = await self._resolve(message.from_user.id, data)
+        if access.allowed or await self._is_public(message):
+            return
+        self.denied += 1
+        await message.answer(access_denied_text(access.status))
+        raise CancelHandler()
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        access = await self._resolve(call.from_user.id, data)
+        if access.allowed:
+            return
+        self.denied += 1
+        await call.answer("❌ Ruxsat yo'q!", show_alert=True)
+        raise CancelHandler()
+
+    @staticmethod
+    def _admin_only():
+        handler = current_handler.get()
+        return getattr(handler, 'admin_only', False)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        if self._admin_only() and not data['access'].is_admin:
+            await message.answer(ADMIN_ONLY_TEXT)
+            raise CancelHandler()
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        if self._admin_only() and not data['access'].is_admin:
+            await call.answer(ADMIN_ONLY_TEXT, show_alert=True)
+            raise CancelHandler()
@@ -1,44 +1,95 @@
-import asyncio
+from collections import OrderedDict
 
-from aiogram import types, Dispatcher
-from aiogram.dispatcher import DEFAULT_RATE_LIMIT
+from aiogram import types
 from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.utils.exceptions import Throttled
 
-from db import db
-from translation import _
+from data.config import THROTTLING_RATE_LIMIT, THROTTLING_BURST, THROTTLING_MAX_BUCKETS
+from utils.misc.token_bucket import TokenBucket
+
+THROTTLED_TEXT = "Juda ko'p so'rovlar!"
 
 
 class ThrottlingMiddleware(BaseMiddleware):
     """
-    Simple middleware
+    Ограничение частоты запросов пользователя.
+
+    Общий для пользователя TokenBucket (один запрос в limit секунд, до burst подряд)
+    проверяется в on_pre_process_*, до фильтров: лишний апдейт отклоняется раньше, чем
+    StateFilter прочитает состояние FSM из Postgres. Обработчики с @rate_limit получают ещё
+    и свой бакет на пару (пользователь, ключ), он проверяется в on_process_*, когда
+    обработчик уже известен, но до него самого. Бакеты лежат в LRU размером не больше
+    max_buckets. Отклонённый апдейт отменяется, а пользователь получает одно предупреждение
+    на серию отказов.
     """
 
-    def __init__(self, limit=DEFAULT_RATE_LIMIT, key_prefix='antiflood_'):
+    def __init__(self, limit=THROTTLING_RATE_LIMIT, burst=THROTTLING_BURST, max_buckets=THROTTLING_MAX_BUCKETS):
         self.rate_limit = limit
-        self.prefix = key_prefix
+        self.burst = burst
+        self.max_buckets = max_buckets
+        # (user_id, key) -> [TokenBucket, предупреждение уже отправлено]; key=None — общий бакет пользователя
+        self._buckets = OrderedDict()
+        self.rejected = 0
+        self.evicted = 0
         super(ThrottlingMiddleware, self).__init__()
 
-    async def on_process_message(self, message: types.Message, data: dict):
+    def _handler_limits(self):
         handler = current_handler.get()
-        dispatcher = Dispatcher.get_current()
-        if handler:
-            limit = getattr(handler, "throttling_rate_limit", self.rate_limit)
-            key = getattr(handler, "throttling_key", f"{self.prefix}_{handler.__name__}")
+        if handler is None or not hasattr(handler, 'throttling_rate_limit'):
+            return None
+        return (getattr(handler, 'throttling_key', handler.__name__),
+                getattr(handler, 'throttling_rate_limit', self.rate_limit),
+                getattr(handler, 'throttling_burst', self.burst))
+
+    def allow(self, user_id, key, limit, burst):
+        """(пропустить ли запрос, нужно ли предупредить пользователя)"""
+        if not limit:
+            return True, False
+        entry = self._buckets.get((user_id, key))
+        if entry is None:
+            entry = self._buckets[(user_id, key)] = [TokenBucket(1 / limit, burst), False]
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
         else:
-            limit = self.rate_limit
-            key = f"{self.prefix}_message"
-        try:
-            await dispatcher.throttle(key, rate=limit)
-        except Throttled as t:
-            await self.message_throttled(message, t)
+            self._buckets.move_to_end((user_id, key))
+        if entry[0].try_acquire():
+            entry[1] = False
+            return True, False
+        self.rejected += 1
+        warn = not entry[1]
+        entry[1] = True
+        return False, warn
+
+    @staticmethod
+    async def _reject_message(message, allowed, warn):
+        if not allowed:
+            if warn:
+                await message.reply(THROTTLED_TEXT)
+            raise CancelHandler()
+
+    @staticmethod
+    async def _reject_callback_query(call, allowed, warn):
+        if not allowed:
+            # Ответить на callback нужно в любом случае, иначе у кнопки крутятся часики
+            await call.answer(THROTTLED_TEXT if warn else None)
             raise CancelHandler()
 
-    async def message_throttled(self, message: types.Message, throttled: Throttled):
-        if throttled.exceeded_count <= 2:
-            try:
-                lang = db.get_lang(message.from_user.id)
-                await message.reply(_("Juda ko'p so'rovlar!",lang))
-            except Exception as ex:
-                await message.reply("Juda ko'p so'rovlar!")
\ No newline at end of file
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        await self._reject_message(message, *self.allow(message.from_user.id, None, self.rate_limit, self.burst))
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        await self._reject_callback_query(call, *self.allow(call.from_user.id, None, self.rate_limit, self.burst))
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        limits = self._handler_limits()
+        if limits is not None:
+            await self._reject_message(message, *self.allow(message.from_user.id, *limits))
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        limits = self._handler_limits()
+        if limits is not None:
+            await self._reject_callback_query(call, *self.allow(call.from_user.id, *limits))
+
+    def stats(self):
+        return {'buckets': len(self._buckets), 'rejected': self.rejected, 'evicted': self.evicted}
@@ -0,0 +1,77 @@
+import re
+import time
+import unittest
+
+from gspread.utils import a1_to_rowcol
+
+from utils.sheets_api.dashboard import DashboardSnapshot
+from utils.sheets_api.report import MESSAGE_LIMIT, ReportPipeline
+from utils.sheets_api.summary import SUMMARY_CELLS, cells_from_values
+
+HEADERS = ["Obekt", "Ostatka Som", "Ostatka $", "Som Kirim", "Izoh"]
+
+
+def sheet(rows):
+    """Лист Dashboard1: итоги в 1-й строке, заголовки во 2-й, компании с 3-й"""
+    summary = [''] * 15
+    for cell, label in SUMMARY_CELLS:
+        summary[a1_to_rowcol(cell)[1] - 1] = "1 234 567 890 so'm"
+    return [summary, HEADERS, *rows]
+
+
+class StaticSource:
+    def __init__(self, values):
+        self.snapshot = DashboardSnapshot(values, cells_from_values(values, SUMMARY_CELLS), time.time())
+
+    async def get(self):
+        return self.snapshot
+
+
+class ReportPagesTest(unittest.IsolatedAsyncioTestCase):
+    """Каждая страница /all помещается в сообщение Telegram и не оставляет открытых тегов"""
+
+    async def render_all(self, values):
+        report = ReportPipeline(StaticSource(values))
+        first, page, pages = await report.render(1)
+        texts = [first] + [(await report.render(n))[0] for n in range(2, pages + 1)]
+        for text in texts:
+            # Длина так, как её считает Telegram: в единицах UTF-16
+            self.assertLessEqual(len(text.encode('utf-16-le')) // 2, MESSAGE_LIMIT)
+            self.assertEqual(text.count('<b>'), text.count('</b>'), text)
+            # Тег не оборван посередине
+            self.assertIsNone(re.search(r'<[^>]*$', text))
+        return texts
+
+    async def test_large_sheet(self):
+        # Эмодзи занимают по два символа UTF-16: длину страницы нельзя считать через len()
+        rows = [[f"🏗 Obekt {i}", f"{i * 1000:,}", f"${i}.50", "1", "💬" * 40] for i in range(500)]
+        texts = await self.render_all(sheet(rows))
+        self.assertGreater(len(texts), 1)
+        body = "\n".join(texts)
+        # Ни одна компания не потерялась и не разрезана между страницами
+        for i in (0, 250, 499):
+            self.assertEqual(body.count(f"<b>{i + 1}. 🏗 Obekt {i}</b>"), 1)
+
+    async def test_company_longer_than_page(self):
+        headers = ["Obekt"] + [f"Ustun {j}" for j in range(1, 400)]
+        row = ["Katta obekt"] + [f"😀 qiymat {j} " * 3 for j in range(1, 400)]
+        values = sheet([row, ["Keyingi obekt", "1"]])
+        values[1] = headers
+        texts = await self.render_all(values)
+        self.assertIn("…", texts[0])
+        self.assertIn("Keyingi obekt", "\n".join(texts))
+
+    async def test_company_with_huge_name(self):
+        # Не помещается даже заголовок компании: обрезка посреди <b> должна закрыть тег
+        texts = await self.render_all(sheet([["😀" * 3000, "1"], ["Keyingi obekt", "1"]]))
+        self.assertIn("…", texts[0])
+
+    async def test_empty_sheet(self):
+        for values in ([], sheet([])):
+            texts = await self.render_all(values)
+            self.assertEqual(len(texts), 1)
+            self.assertIn("Umumiy qoldiq", texts[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+from aiohttp.test_utils import TestClient, TestServer
+
+from utils.misc import webhook
+from utils.misc.webhook import SECRET_HEADER, SecureWebhookHandler, make_webhook_app
+
+
+def message_update(update_id):
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'text': 'x',
+                    'chat': {'id': 1, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': False, 'first_name': 'a'}},
+    }
+
+
+class SecureWebhookHandlerTest(unittest.IsolatedAsyncioTestCase):
+    """Вебхук под нагрузкой от поддельного Telegram: секрет и ограничение параллельности"""
+
+    async def asyncSetUp(self):
+        self.dp = Dispatcher(Bot('123:abc'))
+        self.release = asyncio.Event()
+        self.running = 0
+        self.max_running = 0
+        self.dp.register_message_handler(self.slow_handler)
+
+        app = make_webhook_app(self.dp, max_concurrency=2)
+        app[BOT_DISPATCHER_KEY] = self.dp
+        app.router.add_route('*', '/webhook', SecureWebhookHandler)
+        self.secret = app[webhook.SECRET_KEY]
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await self.client.close()
+        await (await self.dp.bot.get_session()).close()
+
+    async def slow_handler(self, message):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await self.release.wait()
+        finally:
+            self.running -= 1
+
+    def send(self, update_id, secret=None):
+        return self.client.post('/webhook', json=message_update(update_id),
+                                headers={SECRET_HEADER: self.secret if secret is None else secret})
+
+    async def test_rejects_wrong_secret(self):
+        response = await self.send(1, secret='wrong')
+        self.assertEqual(response.status, 401)
+        self.assertEqual(self.max_running, 0)
+
+    async def test_limits_concurrent_updates(self):
+        requests = [asyncio.ensure_future(self.send(i)) for i in range(6)]
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.running, 2)
+        self.release.set()
+        responses = await asyncio.gather(*requests)
+        self.assertEqual([r.status for r in responses], [200] * 6)
+        self.assertEqual(self.max_running, 2)
+
+    async def test_slot_held_after_response_timeout(self):
+        # Telegram получает 'ok' по таймауту, но апдейт ещё обрабатывается и держит слот
+        with mock.patch.object(webhook, 'RESPONSE_TIMEOUT', 0.05), \
+                mock.patch.object(SecureWebhookHandler, 'respond_via_request'):
+            responses = await asyncio.gather(self.send(1), self.send(2))
+            self.assertEqual([r.status for r in responses], [200, 200])
+            waiting = asyncio.ensure_future(self.send(3))
+            await asyncio.sleep(0.2)
+            self.assertEqual(self.running, 2)
+            self.assertFalse(waiting.done())
+            self.release.set()
+            self.assertEqual((await waiting).status, 200)
+        self.assertEqual(self.max_running, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
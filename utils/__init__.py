@@ -1,3 +1,19 @@
-from . import db_api
-from . import misc
-from .notify_admins import on_startup_notify
+import importlib
+
+# Подпакеты загружаются при первом обращении: импорт utils.misc.formatting
+# не должен тянуть aiogram, psycopg2 и gspread
+_LAZY = {
+    'db_api': ('.db_api', None),
+    'misc': ('.misc', None),
+    'on_startup_notify': ('.notify_admins', 'on_startup_notify'),
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY[name]
+    module = importlib.import_module(module_name, __name__)
+    value = module if attr is None else getattr(module, attr)
+    globals()[name] = value
+    return value
@@ -0,0 +1,329 @@
+"""
+Асинхронный доступ к БД через asyncpg (DB_BACKEND=asyncpg).
+
+Те же функции, что и в utils.db_api.postgres, но без пула потоков. asyncpg
+готовит каждый запрос как prepared statement и кеширует его на соединении,
+поэтому повторные запросы из хендлеров не разбираются сервером заново.
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+import asyncpg
+
+from utils.db_api.postgres import ADD_TO_BALANCE_TOTALS
+from data.config import ADMINS, DB_SETTINGS, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_MAX_IDLE, DB_POOL_TIMEOUT
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    database=DB_SETTINGS['dbname'],
+                    user=DB_SETTINGS['user'],
+                    password=DB_SETTINGS['password'],
+                    host=DB_SETTINGS['host'],
+                    port=int(DB_SETTINGS['port']),
+                    min_size=DB_POOL_MIN,
+                    max_size=DB_POOL_MAX,
+                    max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+                    timeout=DB_POOL_TIMEOUT,
+                )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def check_user_access(user_id):
+    """Проверяет доступ пользователя к боту"""
+    if user_id in ADMINS:
+        return True, "admin"
+
+    try:
+        pool = await get_pool()
+        status = await pool.fetchval("SELECT status FROM users WHERE user_id = $1", user_id)
+    except Exception as e:
+        logging.error(f"Ошибка при проверке доступа пользователя {user_id}: {e}")
+        return False, "error"
+
+    if status is None:
+        return False, "not_registered"
+    if status == 'approved':
+        return True, "approved"
+    return False, f"blocked ({status})"
+
+
+async def get_user_status(user_id):
+    pool = await get_pool()
+    return await pool.fetchval('SELECT status FROM users WHERE user_id=$1', user_id)
+
+
+async def register_user(user_id, name, phone):
+    pool = await get_pool()
+    try:
+        await pool.execute('INSERT INTO users (user_id, name, phone, status, reg_date) VALUES ($1, $2, $3, $4, $5) ON CONFLICT (user_id) DO NOTHING',
+                           user_id, name, phone, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    except Exception as e:
+        logging.error(f"register_user: не удалось записать пользователя {user_id}: {e}")
+
+
+async def update_user_status(user_id, status):
+    pool = await get_pool()
+    await pool.execute('UPDATE users SET status=$1 WHERE user_id=$2', status, user_id)
+
+
+async def get_user_name(user_id):
+    pool = await get_pool()
+    return await pool.fetchval('SELECT name FROM users WHERE user_id=$1', user_id) or ''
+
+
+async def get_pay_types():
+    pool = await get_pool()
+    return [row[0] for row in await pool.fetch('SELECT name FROM pay_types')]
+
+
+async def get_categories():
+    pool = await get_pool()
+    return [row[0] for row in await pool.fetch('SELECT name FROM categories ORDER BY id')]
+
+
+async def save_registration(user_id, name, phone):
+    pool = await get_pool()
+    await pool.execute("""
+        INSERT INTO users (user_id, name, phone, status, reg_date)
+        VALUES ($1, $2, $3, 'pending', NOW())
+        ON CONFLICT (user_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        phone = EXCLUDED.phone,
+        status = 'pending'
+    """, user_id, name, phone)
+
+
+async def add_approved_user(user_id, name, phone):
+    """Возвращает False, если пользователь уже существует"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if await conn.fetchval("SELECT user_id FROM users WHERE user_id = $1", user_id):
+                return False
+            await conn.execute("""
+                INSERT INTO users (user_id, name, phone, status, reg_date)
+                VALUES ($1, $2, $3, 'approved', NOW())
+            """, user_id, name, phone)
+            return True
+
+
+async def list_users(status):
+    pool = await get_pool()
+    return await pool.fetch("SELECT user_id, name, phone, reg_date FROM users WHERE status=$1 ORDER BY reg_date DESC", status)
+
+
+async def list_reachable_user_ids(status):
+    """id пользователей со статусом status, не заблокировавших бота"""
+    pool = await get_pool()
+    return [row[0] for row in await pool.fetch('SELECT user_id FROM users WHERE status=$1 AND NOT bot_blocked', status)]
+
+
+async def set_bot_blocked(user_id, blocked):
+    """Отмечает, что пользователь заблокировал бота (или снова доступен); True, если отметка изменилась"""
+    pool = await get_pool()
+    result = await pool.execute('UPDATE users SET bot_blocked=$1 WHERE user_id=$2 AND bot_blocked<>$1', blocked, user_id)
+    return result != 'UPDATE 0'
+
+
+async def get_users_overview(limit=5):
+    """Количество пользователей и последние зарегистрированные"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        users_count = await conn.fetchval("SELECT COUNT(*) FROM users")
+        recent_users = await conn.fetch("SELECT user_id, name, phone, status, reg_date FROM users ORDER BY id DESC LIMIT $1", limit)
+    return users_count, recent_users
+
+
+async def add_pay_type(name):
+    """Возвращает False, если такой To'lov turi уже есть"""
+    pool = await get_pool()
+    try:
+        await pool.execute('INSERT INTO pay_types (name) VALUES ($1)', name)
+        return True
+    except asyncpg.UniqueViolationError:
+        return False
+
+
+async def rename_pay_type(old_name, new_name):
+    pool = await get_pool()
+    await pool.execute('UPDATE pay_types SET name=$1 WHERE name=$2', new_name, old_name)
+
+
+async def delete_pay_type(name):
+    pool = await get_pool()
+    await pool.execute('DELETE FROM pay_types WHERE name=$1', name)
+
+
+async def add_category(name, emoji=''):
+    """Возвращает False, если такая категория уже есть"""
+    pool = await get_pool()
+    try:
+        await pool.execute('INSERT INTO categories (name, emoji) VALUES ($1, $2)', name, emoji)
+        return True
+    except asyncpg.UniqueViolationError:
+        return False
+
+
+async def rename_category(old_name, new_name):
+    pool = await get_pool()
+    await pool.execute('UPDATE categories SET name=$1 WHERE name=$2', new_name, old_name)
+
+
+async def delete_category(name):
+    pool = await get_pool()
+    await pool.execute('DELETE FROM categories WHERE name=$1', name)
+
+
+async def replace_categories(names):
+    """Полностью заменяет содержимое таблицы categories"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute('DELETE FROM categories')
+            await conn.executemany('INSERT INTO categories (name) VALUES ($1)', [(name,) for name in names])
+
+
+async def recreate_categories_table(names):
+    """Очищает categories со сбросом id и заполняет заново; схема (столбец emoji) сохраняется"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute('TRUNCATE categories RESTART IDENTITY')
+            await conn.executemany('INSERT INTO categories (name) VALUES ($1)', [(name,) for name in names])
+
+
+async def add_transaction(date, time, amount, currency, type, pay_type, category, comment, user_id):
+    """Записывает операцию в журнал и возвращает её id"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            transaction_id = await conn.fetchval('''INSERT INTO transactions (date, time, amount, currency, type, pay_type, category, comment, user_id)
+                                                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9) RETURNING id''',
+                                                date, time, amount, currency, type, pay_type, category, comment, user_id)
+            await conn.execute(ADD_TO_BALANCE_TOTALS.format('$1', '$2', '$3', '$4', '$5::numeric'),
+                               currency, pay_type, category, type, amount)
+    return transaction_id
+
+
+async def fetch_unsynced_transactions(sheet_name, limit):
+    """
+    Операции выше high-water mark листа в порядке id:
+    [(id, user_id, date, time, amount, currency, type, pay_type, category, comment, user_name), ...]
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # SHARE ждёт незавершённые вставки, см. postgres.fetch_unsynced_transactions
+            await conn.execute('LOCK TABLE transactions IN SHARE MODE')
+            rows = await conn.fetch("""SELECT t.id, t.user_id, t.date, t.time, t.amount, t.currency, t.type, t.pay_type,
+                                              t.category, t.comment, COALESCE(u.name, '')
+                                       FROM transactions t LEFT JOIN users u ON u.user_id = t.user_id
+                                       WHERE t.id > COALESCE((SELECT last_id FROM sheet_sync_state WHERE name = $1), 0)
+                                       ORDER BY t.id LIMIT $2""", sheet_name, limit)
+    return [tuple(row) for row in rows]
+
+
+async def mark_transactions_synced(sheet_name, last_id):
+    """Сдвигает high-water mark листа до last_id"""
+    pool = await get_pool()
+    await pool.execute("""INSERT INTO sheet_sync_state (name, last_id, synced_at) VALUES ($1, $2, NOW())
+                          ON CONFLICT (name) DO UPDATE SET
+                          last_id = GREATEST(sheet_sync_state.last_id, EXCLUDED.last_id),
+                          synced_at = EXCLUDED.synced_at""", sheet_name, last_id)
+
+
+async def mark_transactions_failed(ids, error):
+    """Запоминает ошибку для операций, которые так и не удалось отправить в лист"""
+    pool = await get_pool()
+    await pool.execute('UPDATE transactions SET sync_error = $1 WHERE id = ANY($2::bigint[])', error, list(ids))
+
+
+async def get_sheet_sync_lag(sheet_name):
+    """Сколько операций ещё не отправлено в лист"""
+    pool = await get_pool()
+    return await pool.fetchval("""SELECT COUNT(*) FROM transactions
+                                  WHERE id > COALESCE((SELECT last_id FROM sheet_sync_state WHERE name = $1), 0)""",
+                               sheet_name)
+
+
+async def get_balance_totals():
+    """(строки balance_totals, {name: начальный остаток})"""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        totals = await conn.fetch('SELECT currency, pay_type, category, kirim, chiqim FROM balance_totals')
+        opening = await conn.fetch('SELECT name, amount FROM balance_opening')
+    return [tuple(row) for row in totals], {row['name']: row['amount'] for row in opening}
+
+
+async def add_balance_opening(name, amount):
+    """Прибавляет amount к начальному остатку name (som, dollar или bank)"""
+    pool = await get_pool()
+    await pool.execute("""INSERT INTO balance_opening (name, amount) VALUES ($1, $2)
+                          ON CONFLICT (name) DO UPDATE SET amount = balance_opening.amount + EXCLUDED.amount""",
+                       name, amount)
+
+
+async def get_fsm_record(chat_id, user_id, ttl):
+    """(state, data) не старше ttl секунд или None"""
+    pool = await get_pool()
+    row = await pool.fetchrow("""SELECT state, data FROM fsm_states
+                                 WHERE chat_id = $1 AND user_id = $2 AND updated_at > NOW() - $3 * INTERVAL '1 second'""",
+                              chat_id, user_id, float(ttl))
+    return tuple(row) if row else None
+
+
+async def set_fsm_state(chat_id, user_id, state, ttl):
+    pool = await get_pool()
+    await pool.execute("""INSERT INTO fsm_states (chat_id, user_id, state) VALUES ($1, $2, $3)
+                          ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                          state = EXCLUDED.state,
+                          data = CASE WHEN fsm_states.updated_at > NOW() - $4 * INTERVAL '1 second'
+                                      THEN fsm_states.data ELSE '{}' END,
+                          updated_at = NOW()""", chat_id, user_id, state, float(ttl))
+
+
+async def set_fsm_data(chat_id, user_id, data, ttl):
+    pool = await get_pool()
+    await pool.execute("""INSERT INTO fsm_states (chat_id, user_id, data) VALUES ($1, $2, $3)
+                          ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                          state = CASE WHEN fsm_states.updated_at > NOW() - $4 * INTERVAL '1 second'
+                                       THEN fsm_states.state END,
+                          data = EXCLUDED.data,
+                          updated_at = NOW()""", chat_id, user_id, data, float(ttl))
+
+
+async def delete_fsm_record(chat_id, user_id):
+    pool = await get_pool()
+    await pool.execute('DELETE FROM fsm_states WHERE chat_id = $1 AND user_id = $2', chat_id, user_id)
+
+
+async def delete_expired_fsm_records(ttl):
+    """Удаляет сценарии, брошенные больше ttl секунд назад; возвращает их количество"""
+    pool = await get_pool()
+    result = await pool.execute("DELETE FROM fsm_states WHERE updated_at < NOW() - $1 * INTERVAL '1 second'", float(ttl))
+    return int(result.split()[-1])
+
+
+async def claim_event(name, cooldown):
+    """True, если событие name не выполнялось cooldown секунд; заодно отмечает его выполненным"""
+    pool = await get_pool()
+    return await pool.fetchval("""INSERT INTO bot_events (name, last_at) VALUES ($1, NOW())
+                                  ON CONFLICT (name) DO UPDATE SET last_at = EXCLUDED.last_at
+                                  WHERE bot_events.last_at < NOW() - $2 * INTERVAL '1 second'
+                                  RETURNING name""", name, float(cooldown)) is not None
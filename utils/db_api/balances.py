@@ -0,0 +1,88 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from utils.sheets_api.summary import SUMMARY_CELLS
+
+# Остаток журнала и итоговая ячейка листа, с которой он сверяется; подписи — из SUMMARY_CELLS
+BALANCE_SOURCES = (
+    ('som', 'D1'),
+    ('dollar', 'G1'),
+    ('bank', 'J1'),
+)
+BALANCE_LABELS = tuple((name, dict(SUMMARY_CELLS)[cell], cell) for name, cell in BALANCE_SOURCES)
+
+
+def parse_amount(text):
+    # "1 500 000" и "1,500,000" -> Decimal('1500000'); ValueError, если это не число
+    try:
+        amount = Decimal(re.sub(r'[\s,]', '', str(text)))
+    except InvalidOperation:
+        raise ValueError(f"Noto'g'ri summa: {text}")
+    if not amount.is_finite():
+        raise ValueError(f"Noto'g'ri summa: {text}")
+    return amount
+
+
+def parse_sheet_amount(text):
+    """Число из отформатированной ячейки листа ("$1,500.00", "1 500 000 so'm") или None"""
+    if not str(text).strip():
+        return Decimal(0)
+    cleaned = re.sub(r'[^\d.\-]', '', str(text).replace(',', ''))
+    try:
+        return Decimal(cleaned)
+    except InvalidOperation:
+        return None
+
+
+def format_amount(amount):
+    """1500000 -> "1 500 000", дробные суммы с двумя знаками"""
+    if amount == amount.to_integral_value():
+        return f"{amount:,.0f}".replace(',', ' ')
+    return f"{amount:,.2f}".replace(',', ' ')
+
+
+class Balances:
+    """
+    Остатки по журналу transactions.
+
+    totals — строки balance_totals (currency, pay_type, category, kirim, chiqim),
+    opening — начальные остатки {'som': ..., 'dollar': ..., 'bank': ...} для операций,
+    которые были в листе до появления журнала.
+    """
+
+    def __init__(self, totals, opening=None):
+        self.totals = [tuple(row) for row in totals]
+        self.opening = opening or {}
+
+    def _sum(self, match):
+        return sum((kirim - chiqim for currency, pay_type, category, kirim, chiqim in self.totals
+                    if match(currency, pay_type, category)), Decimal(0))
+
+    @property
+    def som(self):
+        return self.opening.get('som', Decimal(0)) + self._sum(lambda currency, pay_type, category: currency != 'Dollar')
+
+    @property
+    def dollar(self):
+        return self.opening.get('dollar', Decimal(0)) + self._sum(lambda currency, pay_type, category: currency == 'Dollar')
+
+    @property
+    def bank(self):
+        # Bank — суммовые операции с To'lov turi "Bank"
+        return self.opening.get('bank', Decimal(0)) + self._sum(
+            lambda currency, pay_type, category: currency != 'Dollar' and pay_type == 'Bank')
+
+    def get(self, name):
+        return getattr(self, name)
+
+    def compare(self, sheet_values):
+        """
+        Сверка с листом: [(name, local, sheet, diff), ...]; sheet_values — {ячейка: текст},
+        diff = sheet - local (None, если ячейку не удалось разобрать)
+        """
+        result = []
+        for name, label, cell in BALANCE_LABELS:
+            local = self.get(name)
+            sheet = parse_sheet_amount(sheet_values.get(cell, '0'))
+            result.append((name, local, sheet, None if sheet is None else sheet - local))
+        return result
@@ -0,0 +1,48 @@
+from utils.misc.singleflight import SingleFlight
+
+
+class Catalog:
+    """
+    Справочник (категории или To'lov turi) в памяти процесса.
+
+    Каждое изменение справочника увеличивает version через bump(); список перечитывается
+    из БД только при первом обращении после этого. Производные объекты (клавиатуры)
+    запоминаются через memoize() и живут, пока не сменится версия.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._flight = SingleFlight(name)
+        self.version = 0
+        self._items = None
+        self._items_version = None
+        self._memo = {}
+        self.loads = 0
+
+    def bump(self):
+        self.version += 1
+
+    async def items(self):
+        if self._items_version != self.version:
+            # Одновременные запросы одной версии ждут одно чтение из БД
+            await self._flight.do(self.version, self._load, self.version)
+        return self._items
+
+    async def _load(self, version):
+        items = await self._loader()
+        # Более старое чтение не должно затереть список новой версии
+        if self._items_version is None or version > self._items_version:
+            self._items = tuple(items)
+            self._items_version = version
+            self._memo = {}
+        self.loads += 1
+
+    async def memoize(self, key, build):
+        """Возвращает build(items), посчитанный один раз для текущей версии справочника"""
+        items = await self.items()
+        value = self._memo.get(key)
+        if value is None:
+            value = build(items)
+            self._memo[key] = value
+        return value
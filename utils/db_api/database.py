@@ -0,0 +1,158 @@
+from functools import partial
+
+from data.config import DB_BACKEND, ACCESS_CACHE_SIZE, ACCESS_CACHE_TTL
+from utils.db_api import postgres
+from utils.db_api.balances import Balances
+from utils.db_api.catalog import Catalog
+from utils.db_api.pool import pool
+from utils.misc.blocking import run_blocking
+from utils.misc.cache import TTLCache
+from utils.misc.metrics import counter, gauge, histogram
+from utils.misc.singleflight import SingleFlight
+
+# user_id -> (has_access, access_type)
+access_cache = TTLCache(maxsize=ACCESS_CACHE_SIZE, ttl=ACCESS_CACHE_TTL)
+# Одновременные чтения одного пользователя: (функция, user_id) -> один запрос к БД
+user_reads = SingleFlight('users')
+
+DB_CALL_SECONDS = histogram('db_call_seconds', 'Время вызовов БД через db', ['function'])
+DB_ERRORS = counter('db_errors', 'Вызовы БД через db, завершившиеся ошибкой', ['function'])
+counter('access_cache_hits', 'Попадания в кеш доступа', collect=lambda: access_cache.hits)
+counter('access_cache_misses', 'Промахи кеша доступа', collect=lambda: access_cache.misses)
+gauge('db_pool_connections', 'Соединения пула psycopg2 по состоянию', ['state'],
+      collect=lambda: {(state,): pool.stats()[state] for state in ('in_use', 'idle', 'waiting')})
+
+
+class Database:
+    """
+    Единая асинхронная точка доступа к БД для хендлеров.
+
+    db.get_categories() и т.п. при DB_BACKEND=psycopg2 выполняют функции из
+    utils.db_api.postgres в пуле потоков, а при DB_BACKEND=asyncpg вызывают
+    одноимённые корутины из utils.db_api.async_postgres.
+    """
+
+    def __init__(self, backend=DB_BACKEND):
+        if backend not in ('psycopg2', 'asyncpg'):
+            raise ValueError(f"Неизвестный DB_BACKEND: {backend}")
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return self._backend(name)
+
+    def _backend(self, name):
+        if self.backend == 'asyncpg':
+            from utils.db_api import async_postgres
+            func = getattr(async_postgres, name)
+        else:
+            func = partial(run_blocking, getattr(postgres, name))
+
+        async def call(*args, **kwargs):
+            with DB_CALL_SECONDS.time(function=name):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    DB_ERRORS.inc(function=name)
+                    raise
+
+        return call
+
+    # --- Доступ пользователей: кешируется, любая смена статуса сбрасывает кеш ---
+    async def check_user_access(self, user_id):
+        result = access_cache.get(user_id)
+        if result is not None:
+            return result
+        return await user_reads.do(('check_user_access', user_id), self._load_user_access, user_id)
+
+    async def _load_user_access(self, user_id):
+        version = access_cache.version(user_id)
+        result = await self._backend('check_user_access')(user_id)
+        # Ошибку БД не кешируем, чтобы следующий запрос попробовал снова
+        if result[1] != "error":
+            access_cache.set(user_id, result, version=version)
+        return result
+
+    async def get_user_status(self, user_id):
+        return await user_reads.do(('get_user_status', user_id), self._backend('get_user_status'), user_id)
+
+    async def get_user_name(self, user_id):
+        return await user_reads.do(('get_user_name', user_id), self._backend('get_user_name'), user_id)
+
+    async def update_user_status(self, user_id, status):
+        try:
+            return await self._backend('update_user_status')(user_id, status)
+        finally:
+            access_cache.invalidate(user_id)
+
+    async def save_registration(self, user_id, name, phone):
+        try:
+            return await self._backend('save_registration')(user_id, name, phone)
+        finally:
+            access_cache.invalidate(user_id)
+
+    async def add_approved_user(self, user_id, name, phone):
+        try:
+            return await self._backend('add_approved_user')(user_id, name, phone)
+        finally:
+            access_cache.invalidate(user_id)
+
+    async def register_user(self, user_id, name, phone):
+        try:
+            return await self._backend('register_user')(user_id, name, phone)
+        finally:
+            access_cache.invalidate(user_id)
+
+    # --- Справочники: читаются из памяти, любое изменение увеличивает версию ---
+    async def get_categories(self):
+        return list(await categories_catalog.items())
+
+    async def get_pay_types(self):
+        return list(await pay_types_catalog.items())
+
+    async def _change_catalog(self, catalog, name, *args):
+        try:
+            return await self._backend(name)(*args)
+        finally:
+            catalog.bump()
+
+    async def add_pay_type(self, name):
+        return await self._change_catalog(pay_types_catalog, 'add_pay_type', name)
+
+    async def rename_pay_type(self, old_name, new_name):
+        return await self._change_catalog(pay_types_catalog, 'rename_pay_type', old_name, new_name)
+
+    async def delete_pay_type(self, name):
+        return await self._change_catalog(pay_types_catalog, 'delete_pay_type', name)
+
+    async def add_category(self, name, emoji=''):
+        return await self._change_catalog(categories_catalog, 'add_category', name, emoji)
+
+    async def rename_category(self, old_name, new_name):
+        return await self._change_catalog(categories_catalog, 'rename_category', old_name, new_name)
+
+    async def delete_category(self, name):
+        return await self._change_catalog(categories_catalog, 'delete_category', name)
+
+    async def replace_categories(self, names):
+        return await self._change_catalog(categories_catalog, 'replace_categories', names)
+
+    async def recreate_categories_table(self, names):
+        return await self._change_catalog(categories_catalog, 'recreate_categories_table', names)
+
+    # --- Остатки по журналу ---
+    async def get_balances(self):
+        totals, opening = await self._backend('get_balance_totals')()
+        return Balances(totals, opening)
+
+    async def close(self):
+        if self.backend == 'asyncpg':
+            from utils.db_api import async_postgres
+            await async_postgres.close_pool()
+        pool.closeall()
+
+
+db = Database()
+categories_catalog = Catalog('categories', lambda: db._backend('get_categories')())
+pay_types_catalog = Catalog('pay_types', lambda: db._backend('get_pay_types')())
+counter('catalog_loads', 'Чтения справочников из БД (после изменения версии)', ['catalog'],
+        collect=lambda: {(catalog.name,): catalog.loads for catalog in (categories_catalog, pay_types_catalog)})
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from data.config import FSM_STATE_TTL, FSM_CLEANUP_INTERVAL, FSM_CACHE_TTL, FSM_CACHE_SIZE
+from utils.db_api.database import db
+from utils.misc.cache import TTLCache
+
+# Записи нет в кеше (None в кеше означает «состояния нет»)
+MISSING = object()
+
+
+def dump_data(data):
+    # Компактный JSON: без пробелов и \u-экранирования кириллицы
+    return json.dumps(data or {}, ensure_ascii=False, separators=(',', ':'))
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_states вместо MemoryStorage.
+
+    Состояния переживают перезапуск и общие для нескольких процессов бота. Сценарий,
+    не продолжавшийся ttl секунд, считается брошенным: он не читается, а фоновый цикл
+    периодически удаляет такие записи. finish() удаляет запись одним запросом.
+
+    Прочитанные и записанные состояния держатся в кеше процесса cache_ttl секунд, поэтому
+    обычное сообщение без сценария не ходит в БД, а finish() без состояния ничего не удаляет.
+    """
+
+    def __init__(self, ttl=FSM_STATE_TTL, cleanup_interval=FSM_CLEANUP_INTERVAL, cache_ttl=FSM_CACHE_TTL,
+                 cache_size=FSM_CACHE_SIZE):
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        # (chat, user) -> (state, data) или None, если записи нет
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._task = None
+
+    @staticmethod
+    def _address(chat, user):
+        chat, user = PostgresStorage.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    async def _record(self, chat, user):
+        address = self._address(chat, user)
+        record = self.cache.get(address, MISSING)
+        if record is not MISSING:
+            return record
+        version = self.cache.version(address)
+        record = await db.get_fsm_record(*address, self.ttl)
+        self.cache.set(address, None if record is None else tuple(record), version=version)
+        return record
+
+    def _remember(self, address, record):
+        # Новая версия ключа: чтение из БД, начатое до записи, не перезапишет кеш
+        self.cache.invalidate(address)
+        self.cache.set(address, record)
+
+    def _cached_data(self, address):
+        """Данные из кеша для записи нового состояния; MISSING, если их там нет"""
+        record = self.cache.get(address, MISSING)
+        if record is MISSING:
+            return MISSING
+        return '{}' if record is None else record[1]
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        record = await self._record(chat, user)
+        if record is None or record[0] is None:
+            return self.resolve_state(default)
+        return record[0]
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        record = await self._record(chat, user)
+        if record is None:
+            return dict(default or {})
+        return json.loads(record[1])
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        address = self._address(chat, user)
+        state = self.resolve_state(state)
+        data = self._cached_data(address)
+        try:
+            await db.set_fsm_state(*address, state, self.ttl)
+        except Exception:
+            self.cache.invalidate(address)
+            raise
+        if data is MISSING:
+            self.cache.invalidate(address)
+        else:
+            self._remember(address, (state, data))
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        address = self._address(chat, user)
+        record = self.cache.get(address, MISSING)
+        data = dump_data(data)
+        try:
+            await db.set_fsm_data(*address, data, self.ttl)
+        except Exception:
+            self.cache.invalidate(address)
+            raise
+        if record is MISSING:
+            self.cache.invalidate(address)
+        else:
+            self._remember(address, (None if record is None else record[0], data))
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        current = await self.get_data(chat=chat, user=user)
+        current.update(data or {}, **kwargs)
+        await self.set_data(chat=chat, user=user, data=current)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        if with_data:
+            address = self._address(chat, user)
+            if self.cache.get(address, MISSING) is None:
+                # Состояния и так нет: finish() в начале хендлера не должен писать в БД
+                return
+            # Один DELETE вместо set_state(None) + set_data({})
+            try:
+                await db.delete_fsm_record(*address)
+            except Exception:
+                self.cache.invalidate(address)
+                raise
+            self._remember(address, None)
+        else:
+            await self.set_state(chat=chat, user=user, state=None)
+
+    async def finish(self, *, chat=None, user=None):
+        await self.reset_state(chat=chat, user=user, with_data=True)
+
+    async def cleanup(self):
+        removed = await db.delete_expired_fsm_records(self.ttl)
+        if removed:
+            logging.info(f"FSM: удалено брошенных сценариев: {removed}")
+        return removed
+
+    async def _run(self):
+        while True:
+            try:
+                await self.cleanup()
+            except Exception as e:
+                logging.warning(f"FSM: не удалось удалить просроченные состояния: {e}")
+            await asyncio.sleep(self.cleanup_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def wait_closed(self):
+        pass
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+import psycopg2
+from psycopg2 import extensions
+
+from data.config import DB_SETTINGS
+from utils.db_api.database import access_cache, categories_catalog, pay_types_catalog
+from utils.misc.blocking import run_blocking
+
+CHANNEL = 'cache_invalidation'
+
+# Без keepalive обрыв сети без закрытия соединения остался бы незамеченным
+KEEPALIVE = dict(keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+
+
+class CacheInvalidationListener:
+    """
+    Сброс кешей процесса по уведомлениям Postgres.
+
+    Триггеры миграции 4 публикуют в канал cache_invalidation изменения users ('users:<user_id>')
+    и справочников ('categories', 'pay_types'). Слушатель держит отдельное соединение и
+    читает уведомления прямо в event loop через add_reader, без потока. Так изменения из
+    другой реплики или из psql видны за миллисекунды. После переподключения кеши
+    сбрасываются целиком: уведомления, пришедшие без соединения, потеряны.
+    """
+
+    def __init__(self, settings=DB_SETTINGS, channel=CHANNEL):
+        self.settings = settings
+        self.channel = channel
+        self._task = None
+        self._delay = 1
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+
+    def handle(self, payload):
+        table, _, key = payload.partition(':')
+        if table == 'users':
+            if key:
+                access_cache.invalidate(int(key))
+        elif table == 'categories':
+            categories_catalog.bump()
+        elif table == 'pay_types':
+            pay_types_catalog.bump()
+        else:
+            logging.warning(f"LISTEN {self.channel}: неизвестное уведомление {payload!r}")
+            return
+        self.received += 1
+
+    @staticmethod
+    def invalidate_all():
+        access_cache.clear()
+        categories_catalog.bump()
+        pay_types_catalog.bump()
+
+    async def _listen(self):
+        conn = await run_blocking(psycopg2.connect, **self.settings, **KEEPALIVE)
+        loop = asyncio.get_event_loop()
+        readable = asyncio.Event()
+        fd = None
+        try:
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as c:
+                c.execute(f'LISTEN {self.channel}')
+            fd = conn.fileno()
+            loop.add_reader(fd, readable.set)
+            self.connected = True
+            self._delay = 1
+            self.invalidate_all()
+            logging.info(f"LISTEN {self.channel}: подключено")
+            while True:
+                await readable.wait()
+                readable.clear()
+                conn.poll()
+                while conn.notifies:
+                    self.handle(conn.notifies.pop(0).payload)
+        finally:
+            self.connected = False
+            if fd is not None:
+                loop.remove_reader(fd)
+            conn.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except Exception as e:
+                logging.warning(f"LISTEN {self.channel}: соединение потеряно, переподключение через {self._delay} с: {e}")
+            self.reconnects += 1
+            await asyncio.sleep(self._delay)
+            self._delay = min(self._delay * 2, 30)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {'connected': self.connected, 'received': self.received, 'reconnects': self.reconnects}
+
+
+cache_listener = CacheInvalidationListener()
@@ -0,0 +1,186 @@
+import logging
+
+from utils.db_api.pool import db_cursor
+from utils.db_api.postgres import REBUILD_BALANCE_TOTALS
+
+DEFAULT_PAY_TYPES = ["Plastik", "Naxt", "Perevod", "Bank"]
+
+DEFAULT_CATEGORIES = ["Мижозлардан", "Аренда техника и инструменты", "Бетон тайёрлаб бериш", "Геология ва лойиха ишлари", "Геология ишлари", "Диз топливо для техники", "Дорожные расходы", "Заправка", "Коммунал и интернет", "Кунлик ишчи", "Объем усталар", "Перевод", "Ойлик ишчилар", "Олиб чикиб кетилган мусор", "Перечесления Расход", "Питание", "Прочие расходы", "Ремонт техники и запчасти", "Сотиб олинган материал", "Карз", "Сотиб олинган снос уйлар", "Валюта операция", "Хизмат (Прочие расходы)", "Хоз товары и инвентарь", "SXF Kapital", "Хожи Ака", "Эхсон", "Хомийлик"]
+
+# Ключ advisory lock: при одновременном старте нескольких процессов миграции применяет один
+MIGRATION_LOCK = 7301
+
+
+def _rebuild_balance_totals_if_empty(c):
+    c.execute('SELECT NOT EXISTS (SELECT 1 FROM balance_totals) AND EXISTS (SELECT 1 FROM transactions)')
+    if c.fetchone()[0]:
+        c.execute(REBUILD_BALANCE_TOTALS)
+
+
+def _seed_defaults(c):
+    # Дефолтные значения только в пустые таблицы
+    for table, names in (('pay_types', DEFAULT_PAY_TYPES), ('categories', DEFAULT_CATEGORIES)):
+        c.execute(f'''INSERT INTO {table} (name)
+                      SELECT name FROM unnest(%s::text[]) WITH ORDINALITY AS t(name, n)
+                      WHERE NOT EXISTS (SELECT 1 FROM {table})
+                      ORDER BY n''', (names,))
+
+
+# (версия, описание, шаги). Шаг — SQL-строка или функция от курсора.
+# Применённые миграции не меняются: новые столбцы и индексы добавляются новой миграцией.
+# Миграция 1 повторяет прежний init_db, поэтому безопасна для уже существующих баз.
+MIGRATIONS = [
+    (1, 'Базовая схема', [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT UNIQUE,
+            name TEXT,
+            phone TEXT,
+            status TEXT,
+            reg_date TEXT
+        )''',
+        # Пользователь заблокировал бота: рассылки его пропускают
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS bot_blocked BOOLEAN NOT NULL DEFAULT FALSE',
+        '''CREATE TABLE IF NOT EXISTS pay_types (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE
+        )''',
+        '''CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE
+        )''',
+        # Журнал операций — основная копия данных; в Google Sheets строки уходят из него
+        '''CREATE TABLE IF NOT EXISTS transactions (
+            id BIGSERIAL PRIMARY KEY,
+            date DATE NOT NULL,
+            time TIME NOT NULL,
+            amount NUMERIC NOT NULL,
+            currency TEXT NOT NULL,
+            type TEXT NOT NULL,
+            pay_type TEXT,
+            category TEXT,
+            comment TEXT,
+            user_id BIGINT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            sync_error TEXT
+        )''',
+        # Итоги журнала по валюте, To'lov turi и категории, обновляются вместе со вставкой операции
+        '''CREATE TABLE IF NOT EXISTS balance_totals (
+            currency TEXT NOT NULL,
+            pay_type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            kirim NUMERIC NOT NULL DEFAULT 0,
+            chiqim NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (currency, pay_type, category)
+        )''',
+        # Начальные остатки (som, dollar, bank) для операций, внесённых в лист до журнала
+        '''CREATE TABLE IF NOT EXISTS balance_opening (
+            name TEXT PRIMARY KEY,
+            amount NUMERIC NOT NULL DEFAULT 0
+        )''',
+        _rebuild_balance_totals_if_empty,
+        # High-water mark: id последней операции, отправленной в лист
+        '''CREATE TABLE IF NOT EXISTS sheet_sync_state (
+            name TEXT PRIMARY KEY,
+            last_id BIGINT NOT NULL DEFAULT 0,
+            synced_at TIMESTAMPTZ
+        )''',
+        # Незаконченные сценарии FSM: data хранится компактным JSON
+        '''CREATE TABLE IF NOT EXISTS fsm_states (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (chat_id, user_id)
+        )''',
+        # Однократные события (рассылка после перезапуска и т.п.): когда выполнялись в последний раз
+        '''CREATE TABLE IF NOT EXISTS bot_events (
+            name TEXT PRIMARY KEY,
+            last_at TIMESTAMPTZ NOT NULL
+        )''',
+        _seed_defaults,
+    ]),
+    # add_category сохраняет эмодзи категории, а столбца не было
+    (2, 'categories.emoji', [
+        "ALTER TABLE categories ADD COLUMN IF NOT EXISTS emoji TEXT NOT NULL DEFAULT ''",
+    ]),
+    # users(user_id) и categories(name) уже проиндексированы ограничением UNIQUE;
+    # второй индекс подстраховывает таблицы, созданные без него
+    (3, 'Индексы для частых запросов', [
+        'CREATE INDEX IF NOT EXISTS users_status_idx ON users (status)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS categories_name_key ON categories (name)',
+    ]),
+    # Изменения пользователей и справочников публикуются в канал cache_invalidation,
+    # utils.db_api.listener сбрасывает по ним кеши во всех процессах бота
+    (4, 'NOTIFY об изменениях users и справочников', [
+        '''CREATE OR REPLACE FUNCTION notify_users_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM pg_notify('cache_invalidation', 'users:' || COALESCE(OLD.user_id::text, ''));
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify('cache_invalidation', 'users:' || COALESCE(NEW.user_id::text, ''));
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql''',
+        '''CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('cache_invalidation', TG_TABLE_NAME);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql''',
+        # bot_blocked на доступ не влияет, поэтому UPDATE только по user_id и status
+        'DROP TRIGGER IF EXISTS users_notify ON users',
+        '''CREATE TRIGGER users_notify AFTER INSERT OR DELETE OR UPDATE OF user_id, status ON users
+           FOR EACH ROW EXECUTE PROCEDURE notify_users_change()''',
+        'DROP TRIGGER IF EXISTS categories_notify ON categories',
+        '''CREATE TRIGGER categories_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categories
+           FOR EACH STATEMENT EXECUTE PROCEDURE notify_catalog_change()''',
+        'DROP TRIGGER IF EXISTS pay_types_notify ON pay_types',
+        '''CREATE TRIGGER pay_types_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON pay_types
+           FOR EACH STATEMENT EXECUTE PROCEDURE notify_catalog_change()''',
+    ]),
+]
+
+
+def _current_version(c):
+    c.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not c.fetchone()[0]:
+        return 0
+    c.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return c.fetchone()[0]
+
+
+def migrate(migrations=MIGRATIONS):
+    """
+    Доводит схему БД до последней версии и возвращает её номер.
+
+    Если схема уже актуальна, выполняются только два лёгких запроса. Иначе недостающие
+    миграции применяются по порядку в одной транзакции под advisory lock,
+    и каждая записывается в schema_version.
+    """
+    latest = migrations[-1][0]
+    with db_cursor() as c:
+        if _current_version(c) >= latest:
+            return latest
+    with db_cursor() as c:
+        c.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK,))
+        c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )''')
+        version = _current_version(c)
+        for number, name, steps in migrations:
+            if number <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute('INSERT INTO schema_version (version, name) VALUES (%s, %s)', (number, name))
+            logging.info(f"Миграция схемы {number}: {name}")
+    return latest
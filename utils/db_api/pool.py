@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from data.config import (DB_SETTINGS, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_MAX_LIFETIME, DB_POOL_MAX_IDLE,
+                         DB_POOL_HEALTH_CHECK_AFTER, DB_POOL_TIMEOUT)
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2.
+
+    Соединения открываются лениво (не больше maxconn), перед выдачей после долгого простоя
+    проверяются запросом SELECT 1, закрываются по истечении max_lifetime, а лишние простаивающие
+    сверх minconn закрываются фоновым потоком через max_idle секунд.
+    """
+
+    def __init__(self, settings=DB_SETTINGS, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 max_lifetime=DB_POOL_MAX_LIFETIME, max_idle=DB_POOL_MAX_IDLE,
+                 health_check_after=DB_POOL_HEALTH_CHECK_AFTER, timeout=DB_POOL_TIMEOUT):
+        self.settings = settings
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        # Простаивающие соединения: (conn, время открытия, время возврата в пул)
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._waiting = 0
+        self._reaper = None
+        self._closed = False
+        self.opened = 0
+        self.discarded = 0
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.settings)
+        self._created[id(conn)] = time.monotonic()
+        self.opened += 1
+        return conn
+
+    def _close(self, conn):
+        self._created.pop(id(conn), None)
+        self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, conn, now):
+        return conn.closed or now - self._created.get(id(conn), now) > self.max_lifetime
+
+    def _is_alive(self, conn):
+        try:
+            with conn.cursor() as c:
+                c.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _start_reaper(self):
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_forever, name='db-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_forever(self):
+        while not self._closed:
+            time.sleep(max(1, self.max_idle / 2))
+            self.reap()
+
+    def reap(self):
+        """Закрывает просроченные соединения и лишние простаивающие сверх minconn"""
+        now = time.monotonic()
+        to_close = []
+        with self._cond:
+            kept = deque()
+            for conn, created, returned in self._idle:
+                idle_too_long = now - returned > self.max_idle and self._size - len(to_close) > self.minconn
+                if self._expired(conn, now) or idle_too_long:
+                    to_close.append(conn)
+                else:
+                    kept.append((conn, created, returned))
+            self._idle = kept
+            self._size -= len(to_close)
+            if to_close:
+                self._cond.notify(len(to_close))
+        for conn in to_close:
+            self._close(conn)
+
+    def getconn(self, timeout=None):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._start_reaper()
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        # Берём последнее возвращённое: остальные дольше простаивают и раньше уйдут в reap
+                        conn, created, returned = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"Нет свободных соединений с БД (занято {self._size})")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            now = time.monotonic()
+            needs_check = now - returned > self.health_check_after
+            if not self._expired(conn, now) and (not needs_check or self._is_alive(conn)):
+                return conn
+            logging.info("Пул БД: закрываем устаревшее или разорванное соединение")
+            self._discard(conn)
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, self._created.get(id(conn), time.monotonic()), time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение и возвращает его в пул; разорванные соединения в пул не возвращаются"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    @contextmanager
+    def cursor(self):
+        """Курсор в транзакции: commit при успехе, rollback при исключении"""
+        with self.connection() as conn:
+            c = conn.cursor()
+            try:
+                yield c
+                conn.commit()
+            except BaseException:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                c.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                'opened': self.opened,
+                'discarded': self.discarded,
+            }
+
+    def closeall(self):
+        self._closed = True
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+        for conn, created, returned in idle:
+            self._close(conn)
+
+
+pool = ConnectionPool()
+
+
+def db_cursor():
+    """Короткая запись для pool.cursor()"""
+    return pool.cursor()
@@ -0,0 +1,348 @@
+import logging
+from datetime import datetime
+
+from psycopg2 import IntegrityError
+
+from data.config import ADMINS
+from utils.db_api.pool import db_cursor
+
+
+# Пересчёт balance_totals по всему журналу
+REBUILD_BALANCE_TOTALS = '''
+    INSERT INTO balance_totals (currency, pay_type, category, kirim, chiqim)
+    SELECT currency, COALESCE(pay_type, ''), COALESCE(category, ''),
+           COALESCE(SUM(amount) FILTER (WHERE type = 'Kirim'), 0),
+           COALESCE(SUM(amount) FILTER (WHERE type <> 'Kirim'), 0)
+    FROM transactions
+    GROUP BY 1, 2, 3
+'''
+
+# Добавление одной операции к balance_totals
+ADD_TO_BALANCE_TOTALS = '''
+    INSERT INTO balance_totals AS b (currency, pay_type, category, kirim, chiqim)
+    VALUES ({0}, COALESCE({1}, ''), COALESCE({2}, ''),
+            CASE WHEN {3} = 'Kirim' THEN {4} ELSE 0 END,
+            CASE WHEN {3} = 'Kirim' THEN 0 ELSE {4} END)
+    ON CONFLICT (currency, pay_type, category) DO UPDATE SET
+    kirim = b.kirim + EXCLUDED.kirim,
+    chiqim = b.chiqim + EXCLUDED.chiqim
+'''
+
+
+def check_user_access(user_id):
+    """Проверяет доступ пользователя к боту"""
+    # Проверяем, является ли пользователь супер-админом
+    if user_id in ADMINS:
+        return True, "admin"
+
+    try:
+        # Проверяем статус пользователя в базе
+        with db_cursor() as c:
+            c.execute("SELECT status FROM users WHERE user_id = %s", (user_id,))
+            result = c.fetchone()
+
+        if result:
+            status = result[0]
+            if status == 'approved':
+                return True, "approved"
+            else:
+                return False, f"blocked ({status})"
+        else:
+            return False, "not_registered"
+
+    except Exception as e:
+        logging.error(f"Ошибка при проверке доступа пользователя {user_id}: {e}")
+        return False, "error"
+
+
+# --- Проверка статуса пользователя ---
+def get_user_status(user_id):
+    with db_cursor() as c:
+        c.execute('SELECT status FROM users WHERE user_id=%s', (user_id,))
+        row = c.fetchone()
+    return row[0] if row else None
+
+
+# --- Регистрация пользователя ---
+def register_user(user_id, name, phone):
+    try:
+        with db_cursor() as c:
+            c.execute('INSERT INTO users (user_id, name, phone, status, reg_date) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (user_id) DO NOTHING',
+                      (user_id, name, phone, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        logging.debug("register_user: пользователь записан", extra={'user_id': user_id})
+    except IntegrityError:
+        logging.debug("register_user: пользователь уже есть", extra={'user_id': user_id})
+    except Exception as e:
+        logging.error(f"register_user: не удалось записать пользователя {user_id}: {e}")
+
+
+# --- Обновление статуса пользователя ---
+def update_user_status(user_id, status):
+    with db_cursor() as c:
+        c.execute('UPDATE users SET status=%s WHERE user_id=%s', (status, user_id))
+
+
+# --- Получение имени пользователя для Google Sheets ---
+def get_user_name(user_id):
+    with db_cursor() as c:
+        c.execute('SELECT name FROM users WHERE user_id=%s', (user_id,))
+        row = c.fetchone()
+    result = row[0] if row else ''
+    logging.debug(f"get_user_name: '{result}'", extra={'user_id': user_id})
+    return result
+
+
+# --- Получение актуальных списков ---
+def get_pay_types():
+    with db_cursor() as c:
+        c.execute('SELECT name FROM pay_types')
+        return [row[0] for row in c.fetchall()]
+
+
+def get_categories():
+    with db_cursor() as c:
+        c.execute('SELECT name FROM categories ORDER BY id')
+        return [row[0] for row in c.fetchall()]
+
+
+# --- Заявка на регистрацию (статус pending) ---
+def save_registration(user_id, name, phone):
+    with db_cursor() as c:
+        c.execute("""
+            INSERT INTO users (user_id, name, phone, status, reg_date)
+            VALUES (%s, %s, %s, 'pending', NOW())
+            ON CONFLICT (user_id) DO UPDATE SET
+            name = EXCLUDED.name,
+            phone = EXCLUDED.phone,
+            status = 'pending'
+        """, (user_id, name, phone))
+
+
+# --- Добавление пользователя админом (сразу approved) ---
+def add_approved_user(user_id, name, phone):
+    """Возвращает False, если пользователь уже существует"""
+    with db_cursor() as c:
+        c.execute("SELECT user_id FROM users WHERE user_id = %s", (user_id,))
+        if c.fetchone():
+            return False
+        c.execute("""
+            INSERT INTO users (user_id, name, phone, status, reg_date)
+            VALUES (%s, %s, %s, 'approved', NOW())
+        """, (user_id, name, phone))
+        return True
+
+
+# --- Списки пользователей по статусу ---
+def list_users(status):
+    with db_cursor() as c:
+        c.execute("SELECT user_id, name, phone, reg_date FROM users WHERE status=%s ORDER BY reg_date DESC", (status,))
+        return c.fetchall()
+
+
+def list_reachable_user_ids(status):
+    """id пользователей со статусом status, не заблокировавших бота"""
+    with db_cursor() as c:
+        c.execute('SELECT user_id FROM users WHERE status=%s AND NOT bot_blocked', (status,))
+        return [row[0] for row in c.fetchall()]
+
+
+def set_bot_blocked(user_id, blocked):
+    """Отмечает, что пользователь заблокировал бота (или снова доступен); True, если отметка изменилась"""
+    with db_cursor() as c:
+        c.execute('UPDATE users SET bot_blocked=%s WHERE user_id=%s AND bot_blocked<>%s', (blocked, user_id, blocked))
+        return c.rowcount > 0
+
+
+def get_users_overview(limit=5):
+    """Количество пользователей и последние зарегистрированные"""
+    with db_cursor() as c:
+        c.execute("SELECT COUNT(*) FROM users")
+        users_count = c.fetchone()[0]
+        c.execute("SELECT user_id, name, phone, status, reg_date FROM users ORDER BY id DESC LIMIT %s", (limit,))
+        recent_users = c.fetchall()
+    return users_count, recent_users
+
+
+# --- Изменение справочников ---
+def add_pay_type(name):
+    """Возвращает False, если такой To'lov turi уже есть"""
+    try:
+        with db_cursor() as c:
+            c.execute('INSERT INTO pay_types (name) VALUES (%s)', (name,))
+        return True
+    except IntegrityError:
+        return False
+
+
+def rename_pay_type(old_name, new_name):
+    with db_cursor() as c:
+        c.execute('UPDATE pay_types SET name=%s WHERE name=%s', (new_name, old_name))
+
+
+def delete_pay_type(name):
+    with db_cursor() as c:
+        c.execute('DELETE FROM pay_types WHERE name=%s', (name,))
+
+
+def add_category(name, emoji=''):
+    """Возвращает False, если такая категория уже есть"""
+    try:
+        with db_cursor() as c:
+            c.execute('INSERT INTO categories (name, emoji) VALUES (%s, %s)', (name, emoji))
+        return True
+    except IntegrityError:
+        return False
+
+
+def rename_category(old_name, new_name):
+    with db_cursor() as c:
+        c.execute('UPDATE categories SET name=%s WHERE name=%s', (new_name, old_name))
+
+
+def delete_category(name):
+    with db_cursor() as c:
+        c.execute('DELETE FROM categories WHERE name=%s', (name,))
+
+
+def replace_categories(names):
+    """Полностью заменяет содержимое таблицы categories"""
+    with db_cursor() as c:
+        c.execute('DELETE FROM categories')
+        for name in names:
+            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
+
+
+def recreate_categories_table(names):
+    """Очищает categories со сбросом id и заполняет заново; схема (столбец emoji) сохраняется"""
+    with db_cursor() as c:
+        c.execute('TRUNCATE categories RESTART IDENTITY')
+        for name in names:
+            c.execute('INSERT INTO categories (name) VALUES (%s)', (name,))
+
+
+# --- Журнал операций и синхронизация с Google Sheets ---
+def add_transaction(date, time, amount, currency, type, pay_type, category, comment, user_id):
+    """Записывает операцию в журнал и возвращает её id"""
+    with db_cursor() as c:
+        c.execute('''INSERT INTO transactions (date, time, amount, currency, type, pay_type, category, comment, user_id)
+                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id''',
+                  (date, time, amount, currency, type, pay_type, category, comment, user_id))
+        transaction_id = c.fetchone()[0]
+        # В той же транзакции, чтобы итоги всегда совпадали с журналом
+        c.execute(ADD_TO_BALANCE_TOTALS.format('%(currency)s', '%(pay_type)s', '%(category)s', '%(type)s', '%(amount)s'),
+                  {'currency': currency, 'pay_type': pay_type, 'category': category, 'type': type, 'amount': amount})
+        return transaction_id
+
+
+def fetch_unsynced_transactions(sheet_name, limit):
+    """
+    Операции выше high-water mark листа в порядке id:
+    [(id, user_id, date, time, amount, currency, type, pay_type, category, comment, user_name), ...]
+    """
+    with db_cursor() as c:
+        # SHARE ждёт незавершённые вставки: иначе операция с меньшим id, закоммиченная
+        # позже большей, осталась бы ниже high-water mark и не попала бы в лист
+        c.execute('LOCK TABLE transactions IN SHARE MODE')
+        c.execute("""SELECT t.id, t.user_id, t.date, t.time, t.amount, t.currency, t.type, t.pay_type,
+                            t.category, t.comment, COALESCE(u.name, '')
+                     FROM transactions t LEFT JOIN users u ON u.user_id = t.user_id
+                     WHERE t.id > COALESCE((SELECT last_id FROM sheet_sync_state WHERE name = %s), 0)
+                     ORDER BY t.id LIMIT %s""", (sheet_name, limit))
+        return c.fetchall()
+
+
+def mark_transactions_synced(sheet_name, last_id):
+    """Сдвигает high-water mark листа до last_id"""
+    with db_cursor() as c:
+        c.execute("""INSERT INTO sheet_sync_state (name, last_id, synced_at) VALUES (%s, %s, NOW())
+                     ON CONFLICT (name) DO UPDATE SET
+                     last_id = GREATEST(sheet_sync_state.last_id, EXCLUDED.last_id),
+                     synced_at = EXCLUDED.synced_at""", (sheet_name, last_id))
+
+
+def mark_transactions_failed(ids, error):
+    """Запоминает ошибку для операций, которые так и не удалось отправить в лист"""
+    with db_cursor() as c:
+        c.execute('UPDATE transactions SET sync_error = %s WHERE id = ANY(%s)', (error, list(ids)))
+
+
+def get_sheet_sync_lag(sheet_name):
+    """Сколько операций ещё не отправлено в лист"""
+    with db_cursor() as c:
+        c.execute("""SELECT COUNT(*) FROM transactions
+                     WHERE id > COALESCE((SELECT last_id FROM sheet_sync_state WHERE name = %s), 0)""",
+                  (sheet_name,))
+        return c.fetchone()[0]
+
+
+# --- Остатки по журналу ---
+def get_balance_totals():
+    """(строки balance_totals, {name: начальный остаток})"""
+    with db_cursor() as c:
+        c.execute('SELECT currency, pay_type, category, kirim, chiqim FROM balance_totals')
+        totals = c.fetchall()
+        c.execute('SELECT name, amount FROM balance_opening')
+        opening = dict(c.fetchall())
+    return totals, opening
+
+
+def add_balance_opening(name, amount):
+    """Прибавляет amount к начальному остатку name (som, dollar или bank)"""
+    with db_cursor() as c:
+        c.execute("""INSERT INTO balance_opening (name, amount) VALUES (%s, %s)
+                     ON CONFLICT (name) DO UPDATE SET amount = balance_opening.amount + EXCLUDED.amount""",
+                  (name, amount))
+
+
+# --- Состояния FSM ---
+def get_fsm_record(chat_id, user_id, ttl):
+    """(state, data) не старше ttl секунд или None"""
+    with db_cursor() as c:
+        c.execute("""SELECT state, data FROM fsm_states
+                     WHERE chat_id = %s AND user_id = %s AND updated_at > NOW() - %s * INTERVAL '1 second'""",
+                  (chat_id, user_id, ttl))
+        return c.fetchone()
+
+
+def set_fsm_state(chat_id, user_id, state, ttl):
+    with db_cursor() as c:
+        # Просроченная запись начинается заново, без старых данных
+        c.execute("""INSERT INTO fsm_states (chat_id, user_id, state) VALUES (%s, %s, %s)
+                     ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                     state = EXCLUDED.state,
+                     data = CASE WHEN fsm_states.updated_at > NOW() - %s * INTERVAL '1 second'
+                                 THEN fsm_states.data ELSE '{}' END,
+                     updated_at = NOW()""", (chat_id, user_id, state, ttl))
+
+
+def set_fsm_data(chat_id, user_id, data, ttl):
+    with db_cursor() as c:
+        c.execute("""INSERT INTO fsm_states (chat_id, user_id, data) VALUES (%s, %s, %s)
+                     ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                     state = CASE WHEN fsm_states.updated_at > NOW() - %s * INTERVAL '1 second'
+                                  THEN fsm_states.state END,
+                     data = EXCLUDED.data,
+                     updated_at = NOW()""", (chat_id, user_id, data, ttl))
+
+
+def delete_fsm_record(chat_id, user_id):
+    with db_cursor() as c:
+        c.execute('DELETE FROM fsm_states WHERE chat_id = %s AND user_id = %s', (chat_id, user_id))
+
+
+def delete_expired_fsm_records(ttl):
+    """Удаляет сценарии, брошенные больше ttl секунд назад; возвращает их количество"""
+    with db_cursor() as c:
+        c.execute("DELETE FROM fsm_states WHERE updated_at < NOW() - %s * INTERVAL '1 second'", (ttl,))
+        return c.rowcount
+
+
+# --- События бота ---
+def claim_event(name, cooldown):
+    """True, если событие name не выполнялось cooldown секунд; заодно отмечает его выполненным"""
+    with db_cursor() as c:
+        c.execute("""INSERT INTO bot_events (name, last_at) VALUES (%s, NOW())
+                     ON CONFLICT (name) DO UPDATE SET last_at = EXCLUDED.last_at
+                     WHERE bot_events.last_at < NOW() - %s * INTERVAL '1 second'
+                     RETURNING name""", (name, cooldown))
+        return c.fetchone() is not None
@@ -1,2 +1,19 @@
-from .throttling import rate_limit
+import importlib
+
 from . import logging
+
+# Загружаются при первом обращении, см. utils/__init__.py
+_LAZY = {
+    'rate_limit': ('.throttling', 'rate_limit'),
+    'admin_only': ('.access', 'admin_only'),
+    'run_blocking': ('.blocking', 'run_blocking'),
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY[name]
+    value = getattr(importlib.import_module(module_name, __name__), attr)
+    globals()[name] = value
+    return value
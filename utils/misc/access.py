@@ -0,0 +1,9 @@
+def admin_only(func):
+    """
+    Decorator for handlers available only to ADMINS, checked by SecurityMiddleware.
+
+    :param func:
+    :return:
+    """
+    setattr(func, 'admin_only', True)
+    return func
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from data.config import IO_TIMEOUT, IO_WORKERS
+from utils.misc.metrics import gauge
+
+
+class BlockingIO:
+    """
+    Пул потоков для блокирующих вызовов psycopg2 и gspread.
+
+    Хендлеры не должны останавливать цикл событий aiogram, поэтому все обращения
+    к БД и Google Sheets выполняются здесь с ограниченным числом потоков и таймаутом.
+    """
+
+    def __init__(self, workers=IO_WORKERS, timeout=IO_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='io')
+        return self._executor
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """
+        Выполняет func(*args, **kwargs) в пуле и ждёт результат не дольше timeout секунд.
+        По таймауту бросает asyncio.TimeoutError; уже запущенный вызов при этом доработает в потоке.
+        timeout=0 — ждать завершения вызова без ограничения (для неидемпотентных записей).
+        """
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        future = self.executor.submit(self._call, func, args, kwargs)
+        future.add_done_callback(self._on_done)
+        if timeout == 0:
+            return await asyncio.wrap_future(future)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def _call(self, func, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _on_done(self, future):
+        with self._lock:
+            if future.cancelled():
+                # Вызов отменён до старта и не успел уменьшить очередь
+                self.queued -= 1
+            elif future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'running': self.running,
+                'max_queued': self.max_queued,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+blocking_io = BlockingIO()
+gauge('io_calls', 'Вызовы в пуле потоков для блокирующего ввода-вывода', ['state'],
+      collect=lambda: {(state,): blocking_io.stats()[state] for state in ('queued', 'running')})
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Короткая запись для blocking_io.run"""
+    return await blocking_io.run(func, *args, **kwargs)
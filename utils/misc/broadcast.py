@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, Unauthorized, ChatNotFound, NetworkError
+
+from data.config import BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_MAX_RETRIES
+from utils.db_api.database import db
+from utils.misc.token_bucket import TokenBucket
+
+# Пользователь заблокировал бота, удалил аккаунт или никогда не писал боту
+UNREACHABLE = (Unauthorized, ChatNotFound)
+
+
+class BroadcastJob:
+    """Прогресс одной рассылки"""
+
+    def __init__(self, name, total):
+        self.name = name
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self):
+        """Отправлено сообщений в секунду"""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0
+
+    def __str__(self):
+        return (f"{self.name}: {self.done}/{self.total}, отправлено {self.sent}, заблокировали {self.blocked}, "
+                f"ошибок {self.failed}, {self.rate:.1f} сообщ./с")
+
+
+class Broadcaster:
+    """
+    Отправка сообщений с соблюдением лимитов Telegram.
+
+    Все отправки бота проходят через общий token bucket (BROADCAST_RATE в секунду).
+    broadcast() раздаёт получателей пулу из workers задач. RetryAfter приостанавливает
+    весь бакет на указанное время, сетевые ошибки повторяются с паузой. Пользователи,
+    заблокировавшие бота, отмечаются в users.bot_blocked и больше не попадают в рассылки.
+    """
+
+    def __init__(self, bot=None, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS, max_retries=BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.jobs = []
+        self.retried = 0
+
+    async def _send(self, chat_id, text, **kwargs):
+        """'sent', 'blocked' или 'failed'"""
+        bot = self.bot or Bot.get_current()
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+                return 'sent'
+            except RetryAfter as e:
+                logging.warning(f"Рассылка: Telegram просит подождать {e.timeout} с")
+                self.bucket.pause(e.timeout)
+            except UNREACHABLE as e:
+                logging.info(f"Рассылка: пользователь {chat_id} недоступен: {e}")
+                try:
+                    await db.set_bot_blocked(chat_id, True)
+                except Exception as db_error:
+                    logging.warning(f"Рассылка: не удалось отметить {chat_id}: {db_error}")
+                return 'blocked'
+            except NetworkError as e:
+                logging.warning(f"Рассылка: сетевая ошибка для {chat_id}: {e}")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logging.warning(f"Рассылка: не удалось отправить {chat_id}: {e}")
+                return 'failed'
+            self.retried += 1
+        return 'failed'
+
+    async def send(self, chat_id, text, **kwargs):
+        """Одно сообщение через общий лимит; True, если доставлено"""
+        return await self._send(chat_id, text, **kwargs) == 'sent'
+
+    async def broadcast(self, chat_ids, text, name='broadcast', **kwargs):
+        """Отправляет text всем chat_ids и возвращает BroadcastJob со счётчиками"""
+        chat_ids = list(dict.fromkeys(chat_ids))
+        job = BroadcastJob(name, len(chat_ids))
+        self.jobs = self.jobs[-9:] + [job]
+        queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+
+        async def worker():
+            while not queue.empty():
+                chat_id = queue.get_nowait()
+                result = await self._send(chat_id, text, **kwargs)
+                setattr(job, result, getattr(job, result) + 1)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(chat_ids)))))
+        job.finished_at = time.monotonic()
+        logging.info(f"Рассылка завершена: {job}")
+        return job
+
+    def stats(self):
+        return {'retried': self.retried, 'jobs': list(self.jobs)}
+
+
+broadcaster = Broadcaster()
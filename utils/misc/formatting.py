@@ -0,0 +1,38 @@
+import re
+from datetime import datetime
+
+# Чистые функции форматирования: без aiogram, БД и Google Sheets,
+# поэтому их можно импортировать из скриптов и бенчмарков без окружения бота
+
+
+def clean_emoji(text):
+    # Удаляет только эмодзи/спецсимволы в начале строки, остальной текст не трогает
+    return re.sub(r'^[^\w\s]+', '', text).strip()
+
+
+def split_emoji_and_text(text):
+    match = re.match(r'^([^ -\x7f\w\s]+)?\s*(.*)', text)
+    if match:
+        emoji = match.group(1) or ''
+        name = match.group(2)
+        return emoji, name
+    return '', text
+
+
+def format_summary(data):
+    tur_emoji = '🟢' if data.get('type') == 'Kirim' else '🔴'
+    dt = data.get('dt', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    # Показываем категорию без эмодзи
+    category_name = data.get('category', '-')
+    currency = data.get('currency', 'Sum')
+    currency_symbol = '💵' if currency == 'Dollar' else '💸'
+    return (
+        f"<b>Natija:</b>\n"
+        f"<b>Tur:</b> {tur_emoji} {data.get('type', '-')}\n"
+        f"<b>Kotegoriya:</b> {category_name}\n"
+        f"<b>Valyuta:</b> {currency_symbol} {currency}\n"
+        f"<b>Summa:</b> {data.get('amount', '-')}\n"
+        f"<b>To'lov turi:</b> {data.get('pay_type', '-')}\n"
+        f"<b>Izoh:</b> {data.get('comment', '-')}\n"
+        f"<b>Vaqt:</b> {dt}"
+    )
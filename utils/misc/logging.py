@@ -1,6 +1,74 @@
+import atexit
+import json
 import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
 
-logging.basicConfig(format=u'%(filename)s [LINE:%(lineno)d] #%(levelname)-8s [%(asctime)s]  %(message)s',
-                    level=logging.INFO,
-                    # level=logging.DEBUG,  # Можно заменить на другой уровень логгирования.
-                    )
+TEXT_FORMAT = u'%(filename)s [LINE:%(lineno)d] #%(levelname)-8s [%(asctime)s]  %(message)s'
+
+# Стандартные атрибуты LogRecord; остальные пришли через extra= и попадают в JSON отдельными полями
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_sampler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, место, сообщение и поля из extra"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'where': f'{record.filename}:{record.lineno}',
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Записи ниже level пропускает только с вероятностью rate"""
+
+    def __init__(self, level, rate):
+        super().__init__()
+        self.level = level
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= self.level or random.random() < self.rate
+
+
+def setup_logging(level='INFO', fmt='text', debug_sample=0.0):
+    """
+    Логирование без блокировки event loop.
+
+    Записи кладутся в очередь (QueueHandler), а в stderr их пишет отдельный поток
+    (QueueListener). fmt='json' выводит по одной JSON-строке на запись. Записи ниже level
+    (обычно DEBUG) отбираются с долей debug_sample ещё до постановки в очередь.
+    """
+    global _sampler
+    level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    _sampler = DebugSampler(level, debug_sample)
+    handler.addFilter(_sampler)
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(logging.DEBUG if debug_sample > 0 else level)
+
+    listener = QueueListener(records, output)
+    listener.start()
+    # Дописываем очередь при выходе из процесса
+    atexit.register(listener.stop)
+
+
+def set_debug_sample(rate):
+    """Меняет долю DEBUG-записей на лету (0 — выключить)"""
+    _sampler.rate = rate
+    logging.getLogger().setLevel(logging.DEBUG if rate > 0 else _sampler.level)
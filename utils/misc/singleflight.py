@@ -0,0 +1,42 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых запросов.
+
+    do(key, func) запускает func() только если для key ещё нет незавершённого вызова;
+    остальные вызывающие ждут тот же результат (или то же исключение). Поэтому на один
+    ключ в любой момент приходится не больше одного обращения к БД или Google Sheets.
+    Отмена одного из ожидающих не отменяет общий вызов.
+    """
+
+    def __init__(self, name=''):
+        self.name = name
+        self._inflight = {}
+        self.calls = 0
+        self.shared = 0
+
+    def in_flight(self, key):
+        return key in self._inflight
+
+    async def do(self, key, func, *args, **kwargs):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Исключение могли не забрать, если все ожидающие были отменены
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self):
+        return {'in_flight': len(self._inflight), 'calls': self.calls, 'shared': self.shared}
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import time
+
+# Отсчёт от импорта модуля: bot.py импортирует его одним из первых
+PROCESS_STARTED = time.monotonic()
+# Именованный логгер: logging.info() при импорте bot.py сам настроил бы корневой логгер
+log = logging.getLogger(__name__)
+
+
+class Startup:
+    """
+    Запуск бота по этапам.
+
+    Быстрые шаги выполняются в on_startup, а медленные (команды бота, рассылка)
+    запускаются через background() и идут уже после того, как бот начал принимать
+    апдейты. Время каждого этапа от старта процесса видно в timings.
+    """
+
+    def __init__(self, started=PROCESS_STARTED):
+        self.started = started
+        # этап -> секунды от старта процесса
+        self.timings = {}
+        # фоновая задача -> (длительность, ошибка или None)
+        self.tasks = {}
+        self._pending = set()
+
+    def mark(self, name):
+        self.timings[name] = time.monotonic() - self.started
+        log.info(f"Запуск: {name} через {self.timings[name]:.2f} с")
+
+    def background(self, name, coro):
+        """Выполняет coro в фоне, не задерживая готовность бота"""
+        async def run():
+            started = time.monotonic()
+            error = None
+            try:
+                await coro
+            except Exception as e:
+                error = e
+                log.warning(f"Запуск: фоновая задача {name} завершилась ошибкой: {e}")
+            self.tasks[name] = (time.monotonic() - started, error)
+
+        task = asyncio.get_event_loop().create_task(run())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def cancel(self):
+        for task in list(self._pending):
+            task.cancel()
+
+
+startup = Startup()
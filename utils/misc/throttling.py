@@ -1,9 +1,10 @@
-def rate_limit(limit: int, key=None):
+def rate_limit(limit: float, key=None, burst=None):
     """
     Decorator for configuring rate limit and key in different functions.
 
-    :param limit:
-    :param key:
+    :param limit: seconds per call for one user, 0 disables the handler limit
+    :param key: shared bucket name, handler name by default
+    :param burst: how many calls may go in a row
     :return:
     """
 
@@ -11,6 +12,8 @@ def rate_limit(limit: int, key=None):
         setattr(func, 'throttling_rate_limit', limit)
         if key:
             setattr(func, 'throttling_key', key)
+        if burst:
+            setattr(func, 'throttling_burst', burst)
         return func
 
     return decorator
@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+
+from aiogram.dispatcher.webhook import RESPONSE_TIMEOUT, WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
+
+from data.config import (WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT,
+                         WEBHOOK_MAX_CONNECTIONS, WEBHOOK_MAX_CONCURRENCY)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+SECRET_KEY = 'WEBHOOK_SECRET'
+SEMAPHORE_KEY = 'UPDATES_SEMAPHORE'
+
+
+def webhook_secret(token, secret=WEBHOOK_SECRET):
+    """WEBHOOK_SECRET или устойчивый секрет из токена бота (одинаковый у всех реплик)"""
+    if secret:
+        return secret
+    return hashlib.sha256(f'webhook:{token}'.encode()).hexdigest()
+
+
+class SecureWebhookHandler(WebhookRequestHandler):
+    """
+    Обработчик вебхука с проверкой секрета Telegram и ограничением параллельности.
+
+    Запрос без правильного X-Telegram-Bot-Api-Secret-Token отклоняется до разбора апдейта.
+    Одновременно обрабатывается не больше WEBHOOK_MAX_CONCURRENCY апдейтов: остальные
+    запросы ждут, и Telegram сам придерживает следующие апдейты. Слот занят, пока апдейт
+    не обработан целиком, даже если Telegram уже получил ответ по RESPONSE_TIMEOUT.
+    """
+
+    async def post(self):
+        secret = self.request.app[SECRET_KEY]
+        if not hmac.compare_digest(self.request.headers.get(SECRET_HEADER, ''), secret):
+            logging.warning(f"Webhook: запрос без верного секрета от {self.request.remote}")
+            raise web.HTTPUnauthorized()
+        return await super().post()
+
+    async def process_update(self, update):
+        semaphore = self.request.app[SEMAPHORE_KEY]
+        await semaphore.acquire()
+        task = asyncio.ensure_future(self.get_dispatcher().updates_handler.notify(update))
+        # Слот освобождает сама задача: колбэк сработает и при отмене до её старта
+        task.add_done_callback(lambda _: semaphore.release())
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), RESPONSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Как в aiogram: отвечаем Telegram 'ok', а результат отправим отдельным запросом
+            task.add_done_callback(self.respond_via_request)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+
+def make_webhook_app(dp, max_concurrency=WEBHOOK_MAX_CONCURRENCY):
+    app = web.Application()
+    app[SECRET_KEY] = webhook_secret(dp.bot._token)
+    app[SEMAPHORE_KEY] = asyncio.Semaphore(max_concurrency)
+    return app
+
+
+def start_webhook(dp, on_startup, on_shutdown, host=WEBHOOK_HOST, path=WEBHOOK_PATH):
+    """Запускает aiohttp-сервер и регистрирует вебхук host + path в Telegram"""
+    if not host:
+        raise RuntimeError("BOT_MODE=webhook требует WEBHOOK_HOST")
+    app = make_webhook_app(dp)
+
+    async def set_webhook(dp):
+        # Вебхук не снимаем при остановке: за балансировщиком могут работать другие реплики
+        await dp.bot.set_webhook(host.rstrip('/') + path, secret_token=app[SECRET_KEY],
+                                 max_connections=WEBHOOK_MAX_CONNECTIONS, drop_pending_updates=True)
+
+    executor = Executor(dp)
+    executor.on_startup([set_webhook, on_startup], polling=False)
+    executor.on_shutdown(on_shutdown, polling=False)
+    executor.set_webhook(webhook_path=path, request_handler=SecureWebhookHandler, web_app=app)
+    executor.run_app(host=WEBAPP_HOST, port=WEBAPP_PORT)
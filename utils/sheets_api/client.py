@@ -0,0 +1,108 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import gspread
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+
+from data.config import (CREDENTIALS_FILE, SCOPES, SHEET_ID, SHEET_NAME, SHEETS_TOKEN_REFRESH_MARGIN,
+                         SHEETS_HTTP_TIMEOUT)
+from utils.misc.metrics import counter, histogram
+
+SHEETS_CALL_SECONDS = histogram('sheets_call_seconds', 'Время запросов к Google Sheets', ['operation'])
+SHEETS_ERRORS = counter('sheets_errors', 'Запросы к Google Sheets, завершившиеся ошибкой', ['operation'])
+
+
+class SheetsClient:
+    """
+    Общий для процесса клиент Google Sheets.
+
+    Авторизуется один раз при первом обращении, держит в памяти клиент,
+    таблицу и листы, обновляет токен заранее и переподключается при ошибках авторизации.
+    """
+
+    def __init__(self, sheet_id=SHEET_ID, credentials_file=CREDENTIALS_FILE, scopes=SCOPES,
+                 refresh_margin=SHEETS_TOKEN_REFRESH_MARGIN, http_timeout=SHEETS_HTTP_TIMEOUT):
+        self.sheet_id = sheet_id
+        self.credentials_file = credentials_file
+        self.scopes = scopes
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.http_timeout = http_timeout
+        self._lock = threading.RLock()
+        self._creds = None
+        self._gc = None
+        self._spreadsheet = None
+        self._worksheets = {}
+
+    def _connect(self):
+        self._creds = Credentials.from_service_account_file(self.credentials_file, scopes=self.scopes)
+        self._gc = gspread.authorize(self._creds)
+        self._gc.set_timeout(self.http_timeout)
+        self._spreadsheet = None
+        self._worksheets = {}
+
+    def _refresh_if_needed(self):
+        # expiry у google-auth хранится в наивном UTC
+        expiry = self._creds.expiry
+        if expiry is None or expiry - datetime.utcnow() < self.refresh_margin:
+            self._creds.refresh(Request())
+
+    def reset(self):
+        """Сбрасывает закешированные объекты, следующее обращение авторизуется заново"""
+        with self._lock:
+            self._creds = None
+            self._gc = None
+            self._spreadsheet = None
+            self._worksheets = {}
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._gc is None:
+                self._connect()
+            self._refresh_if_needed()
+            if self._spreadsheet is None:
+                self._spreadsheet = self._gc.open_by_key(self.sheet_id)
+            return self._spreadsheet
+
+    def worksheet(self, name=SHEET_NAME):
+        with self._lock:
+            spreadsheet = self.spreadsheet()
+            worksheet = self._worksheets.get(name)
+            if worksheet is None:
+                worksheet = spreadsheet.worksheet(name)
+                self._worksheets[name] = worksheet
+            return worksheet
+
+    def call(self, operation, *args, sheet_name=SHEET_NAME, **kwargs):
+        """
+        Вызывает метод листа по имени, например call('get_all_values') или call('acell', 'D1').
+        При ошибке авторизации один раз переподключается и повторяет запрос.
+        """
+        with SHEETS_CALL_SECONDS.time(operation=operation):
+            try:
+                return self._call(operation, *args, sheet_name=sheet_name, **kwargs)
+            except Exception:
+                SHEETS_ERRORS.inc(operation=operation)
+                raise
+
+    def _call(self, operation, *args, sheet_name=SHEET_NAME, **kwargs):
+        try:
+            return getattr(self.worksheet(sheet_name), operation)(*args, **kwargs)
+        except (RefreshError, gspread.exceptions.APIError) as e:
+            if not _is_auth_error(e):
+                raise
+            logging.warning(f"Google Sheets: ошибка авторизации при {operation}, переподключаемся: {e}")
+            self.reset()
+            return getattr(self.worksheet(sheet_name), operation)(*args, **kwargs)
+
+
+def _is_auth_error(error):
+    if isinstance(error, RefreshError):
+        return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 401
+
+
+sheets = SheetsClient()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+
+from data.config import DASHBOARD_REFRESH_INTERVAL
+from utils.misc.blocking import run_blocking
+from utils.misc.singleflight import SingleFlight
+from utils.sheets_api.client import sheets
+from utils.sheets_api.summary import SUMMARY_CELLS, cells_from_values
+
+
+class DashboardSnapshot:
+    """Содержимое Dashboard1 на момент fetched_at"""
+
+    def __init__(self, values, totals, fetched_at):
+        self.values = values
+        # Одинаковое содержимое листа даёт одинаковую ревизию, даже если снимок перечитан
+        self.revision = hash(tuple(tuple(row) for row in values))
+        # Итоговые ячейки SUMMARY_CELLS: ячейка -> значение
+        self.totals = totals
+        self.fetched_at = fetched_at
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+
+def fetch_snapshot():
+    # Итоги лежат в первой строке, поэтому приходят тем же запросом, что и данные
+    values = sheets.call('get_all_values')
+    return DashboardSnapshot(values, cells_from_values(values, SUMMARY_CELLS), time.time())
+
+
+class DashboardService:
+    """
+    Снимок листа Dashboard1 для /all.
+
+    Снимок обновляется фоново раз в refresh_interval секунд и сразу после наших записей
+    в лист. Запросы получают последний снимок без ожидания (stale-while-revalidate);
+    одновременно выполняется не больше одного чтения листа.
+    """
+
+    def __init__(self, refresh_interval=DASHBOARD_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._flight = SingleFlight('dashboard')
+        self._loop = None
+        self._task = None
+        self.refreshes = 0
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    async def refresh(self):
+        """Перечитывает лист; параллельные вызовы ждут одно и то же чтение"""
+        return await self._flight.do('refresh', self._refresh)
+
+    async def _refresh(self):
+        snapshot = await run_blocking(fetch_snapshot)
+        self._snapshot = snapshot
+        self.refreshes += 1
+        return snapshot
+
+    def _refresh_in_background(self):
+        if self._flight.in_flight('refresh'):
+            return
+        task = asyncio.ensure_future(self.refresh())
+        task.add_done_callback(_log_refresh_error)
+
+    async def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return await self.refresh()
+        if snapshot.age > self.refresh_interval:
+            self._refresh_in_background()
+        return snapshot
+
+    def request_refresh(self):
+        """Просит обновить снимок после записи в лист; можно вызывать из любого потока"""
+        if self._loop is None:
+            # Фоновое обновление не запущено: следующий запрос перечитает лист сам
+            self._snapshot = None
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._refresh_in_background()
+        else:
+            self._loop.call_soon_threadsafe(self._refresh_in_background)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.warning(f"Dashboard1: фоновое обновление не удалось: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _log_refresh_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning(f"Dashboard1: обновление снимка не удалось: {task.exception()}")
+
+
+dashboard = DashboardService()
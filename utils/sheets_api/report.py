@@ -0,0 +1,160 @@
+from utils.sheets_api.dashboard import dashboard
+from utils.sheets_api.summary import SUMMARY_CELLS
+
+# Telegram не принимает сообщения длиннее 4096 символов (в UTF-16)
+MESSAGE_LIMIT = 4096
+# Запас на странице под заголовок с номером и итоги Umumiy qoldiq
+PAGE_RESERVE = 700
+
+TITLE = "📊 <b>SXF moliyaviy malumot</b>"
+
+# Столбцы которые нужно исключить
+EXCLUDED_HEADERS = frozenset((
+    "Som Kirim",
+    "Som chiqim",
+    "Kirim $",
+    "Chiqim $",
+    "Bank kirim",
+    "Bank chiqim",
+))
+
+
+def text_length(text):
+    """Длина так, как её считает Telegram: эмодзи вне BMP занимают два символа"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def parse_headers(values):
+    """(заголовки, строки компаний) из get_all_values() листа Dashboard1"""
+    # Заголовки во 2-й строке, данные с 3-й; берём только строки с названием в первой колонке
+    headers = values[1] if len(values) > 1 else []
+    data_rows = [row for row in values[2:] if row and row[0]]
+    return headers, data_rows
+
+
+def filter_columns(headers, data_rows, excluded_headers=EXCLUDED_HEADERS):
+    """[(название, [(заголовок, значение), ...]), ...] только с непустыми и не исключёнными столбцами"""
+    companies = []
+    for row in data_rows:
+        fields = []
+        for j, cell_value in enumerate(row[1:], 1):  # начиная со 2-го столбца
+            if not cell_value:
+                continue
+            header = headers[j] if j < len(headers) else f"Столбец {j+1}"
+            if header not in excluded_headers:
+                fields.append((header, cell_value))
+        companies.append((row[0], fields))
+    return companies
+
+
+def format_blocks(companies):
+    """Блок текста на каждую компанию"""
+    blocks = []
+    for i, (name, fields) in enumerate(companies, 1):
+        lines = [f"<b>{i}. {name}</b>"]
+        lines.extend(f"   <b>{header}:</b> {value}" for header, value in fields)
+        blocks.append("\n".join(lines))
+    return blocks
+
+
+def _truncate(block, budget):
+    # Одна компания не влезает в страницу: оставляем столько строк, сколько помещается
+    lines = block.split("\n")
+    suffix = "\n   …"
+    # + пустая строка между блоками и запас на закрывающий </b>
+    budget -= text_length(suffix) + 2 + 4
+    while len(lines) > 1 and text_length("\n".join(lines)) > budget:
+        lines.pop()
+    text = "\n".join(lines)
+    while text_length(text) > budget:
+        overflow = text_length(text) - budget
+        text = text[:len(text) - max(1, (overflow + 1) // 2)]
+        # Не оставляем оборванный HTML-тег
+        if text.rfind('<') > text.rfind('>'):
+            text = text[:text.rfind('<')]
+    if text.count('<b>') > text.count('</b>'):
+        text += '</b>'
+    return text + suffix
+
+
+def split_pages(blocks, budget=MESSAGE_LIMIT - PAGE_RESERVE):
+    """Делит блоки на страницы не длиннее budget, не разрывая блок компании"""
+    pages = []
+    current = []
+    size = 0
+    for block in blocks:
+        # + пустая строка между блоками
+        length = text_length(block) + 2
+        if length > budget:
+            block = _truncate(block, budget)
+            length = text_length(block) + 2
+        if current and size + length > budget:
+            pages.append(current)
+            current = []
+            size = 0
+        current.append(block)
+        size += length
+    if current or not pages:
+        pages.append(current)
+    return pages
+
+
+def totals_footer(totals, age):
+    lines = ["💰 <b>Umumiy qoldiq</b>"]
+    lines.extend(f"{label} : {totals[cell]}" for cell, label in SUMMARY_CELLS)
+    return "\n".join(lines) + f"\n\n🕒 Yangilangan: {int(age)} soniya oldin"
+
+
+def render_page(blocks, page, pages, footer):
+    title = TITLE if pages == 1 else f"{TITLE} ({page}/{pages})"
+    return "\n\n".join([title, *blocks, footer])
+
+
+class ReportPipeline:
+    """
+    Отчёт /all: fetch -> parse_headers -> filter_columns -> format_blocks -> split_pages.
+
+    Результат каждой стадии запоминается по revision снимка листа, поэтому фоновое
+    обновление с тем же содержимым ничего не пересчитывает. Чтение листа общее для
+    одновременных запросов (DashboardService.refresh), а остальные стадии выполняются
+    без await и не могут посчитаться дважды для одной ревизии.
+    """
+
+    def __init__(self, source, excluded_headers=EXCLUDED_HEADERS, budget=MESSAGE_LIMIT - PAGE_RESERVE):
+        self.source = source
+        self.excluded_headers = excluded_headers
+        self.budget = budget
+        # Стадия -> (revision, результат)
+        self._memo = {}
+        self.computed = {}
+
+    def _stage(self, name, revision, build):
+        cached = self._memo.get(name)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+        value = build()
+        self._memo[name] = (revision, value)
+        self.computed[name] = self.computed.get(name, 0) + 1
+        return value
+
+    async def fetch(self):
+        return await self.source.get()
+
+    def pages(self, snapshot):
+        revision = snapshot.revision
+        headers, data_rows = self._stage('parse_headers', revision, lambda: parse_headers(snapshot.values))
+        companies = self._stage('filter_columns', revision,
+                                lambda: filter_columns(headers, data_rows, self.excluded_headers))
+        blocks = self._stage('format_blocks', revision, lambda: format_blocks(companies))
+        return self._stage('split_pages', revision, lambda: split_pages(blocks, self.budget))
+
+    async def render(self, page):
+        """(текст страницы, номер страницы, всего страниц)"""
+        snapshot = await self.fetch()
+        pages = self.pages(snapshot)
+        page = max(1, min(page, len(pages)))
+        footer = totals_footer(snapshot.totals, snapshot.age)
+        return render_page(pages[page - 1], page, len(pages), footer), page, len(pages)
+
+
+all_report = ReportPipeline(dashboard)
@@ -0,0 +1,37 @@
+from gspread.utils import a1_to_rowcol
+
+from utils.sheets_api.client import sheets
+
+# Итоговые ячейки Dashboard1 и их подписи — единственное место, где задано соответствие
+SUMMARY_CELLS = (
+    ('D1', 'Ostatka Som'),
+    ('G1', 'Ostatka $'),
+    ('J1', 'Ostatka Bank'),
+    ('M1', 'Bugungi qarzdorlar'),
+    ('N1', 'Umumiy Qarzdorlar'),
+    ('O1', 'Mavjud Obektlar summasi'),
+)
+
+# Остатки, которые показываем после записи новой строки
+BALANCE_CELLS = (
+    ('C1', '💵 Доллары'),
+    ('D1', '💸 Суммы'),
+)
+
+
+def cells_from_values(values, cells):
+    """Достаёт значения ячеек из уже прочитанного get_all_values(), без запросов к API"""
+    result = {}
+    for cell, label in cells:
+        row, col = a1_to_rowcol(cell)
+        try:
+            result[cell] = values[row - 1][col - 1] or '0'
+        except IndexError:
+            result[cell] = '0'
+    return result
+
+
+def read_cells(cells):
+    """Читает все ячейки одним batch_get вместо отдельного acell на каждую"""
+    ranges = sheets.call('batch_get', [cell for cell, label in cells])
+    return {cell: value_range.first() or '0' for (cell, label), value_range in zip(cells, ranges)}
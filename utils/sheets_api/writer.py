@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import random
+
+import gspread
+import requests
+
+from data.config import (SHEET_NAME, SHEETS_WRITE_BATCH_SIZE, SHEETS_WRITE_MAX_DELAY, SHEETS_WRITE_MAX_ATTEMPTS,
+                         SHEETS_WRITE_BACKOFF_BASE, SHEETS_WRITE_BACKOFF_MAX)
+from utils.db_api.database import db
+from utils.misc.blocking import run_blocking
+from utils.sheets_api.client import sheets
+from utils.sheets_api.dashboard import dashboard
+from utils.sheets_api.summary import BALANCE_CELLS, read_cells
+
+
+def is_retryable(error):
+    """
+    429 и 5xx от Google, а также сбои соединения стоит повторить позже.
+    Таймауты не повторяем: строки могли уже попасть в лист, а append_rows не идемпотентен.
+    """
+    if isinstance(error, requests.ConnectionError):
+        return True
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(error.response, 'status_code', None)
+        return status == 429 or (status is not None and status >= 500)
+    return False
+
+
+def sheet_amount(amount):
+    # Целые суммы пишем без ".00", чтобы формулы листа видели обычные числа
+    return int(amount) if amount == amount.to_integral_value() else float(amount)
+
+
+def transaction_row(date, time, amount, currency, type, pay_type, category, comment, user_name):
+    """Строка Dashboard1 для операции из журнала"""
+    return [
+        f"{date.month}/{date.day}/{date.year}",             # Kun (A) - дата, формат 7/30/2025
+        time.strftime('%H:%M'),                             # Vaqt (B) - время
+        sheet_amount(amount) if currency == 'Dollar' else '',  # $ (C) - доллары
+        sheet_amount(amount) if currency != 'Dollar' else '',  # Summa (D) - суммы
+        type,                                               # Kirim-Chiqim (E)
+        pay_type or '',                                     # To'lov turi (F)
+        category or '',                                     # Kotegoriyalar (G)
+        '',                                                 # Loyihalar (H) - пусто
+        comment or '',                                      # Izoh (I)
+        '',                                                 # Oylik ko'rsatkich (J) - пусто
+        user_name,                                          # User (K) - имя пользователя
+    ]
+
+
+class SheetWriter:
+    """
+    Фоновая синхронизация журнала transactions с листом Dashboard1.
+
+    Операции сначала записываются в Postgres, а этот цикл дописывает в лист всё, что выше
+    high-water mark (sheet_sync_state.last_id), одним append_rows на пачку: как только
+    notify() насчитал batch_size новых операций или прошло не больше max_delay секунд.
+    Без notify() журнал не читается, кроме первого прохода после start().
+    При 429/5xx отправка откладывается с экспоненциальной паузой; после max_attempts неудач
+    операции помечаются sync_error и пропускаются, чтобы не держать очередь.
+    Результат по каждой операции передаётся в on_status(user_id, transaction_id, status, balances),
+    где balances — остатки BALANCE_CELLS, прочитанные один раз на отправленную пачку.
+    """
+
+    def __init__(self, sheet_name=SHEET_NAME, batch_size=SHEETS_WRITE_BATCH_SIZE, max_delay=SHEETS_WRITE_MAX_DELAY,
+                 max_attempts=SHEETS_WRITE_MAX_ATTEMPTS, backoff_base=SHEETS_WRITE_BACKOFF_BASE,
+                 backoff_max=SHEETS_WRITE_BACKOFF_MAX):
+        self.sheet_name = sheet_name
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_status = None
+        self._wakeup = None
+        self._queued = 0
+        self._task = None
+        self._stopping = False
+        # last_id пачки, которая уже в листе, но ещё не отмечена в sheet_sync_state
+        self._unmarked = None
+        # Фоновые уведомления пользователей о записанных пачках
+        self._reports = set()
+        # Неудачные попытки отправить текущую голову очереди
+        self._attempts = 0
+        # До этого момента (loop.time()) очередь не отправляется: Google попросил подождать
+        self._resume_at = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def backoff(self, attempts):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempts)
+        return delay * random.uniform(0.5, 1)
+
+    def notify(self):
+        """Сообщает, что в журнал добавлена операция"""
+        self._queued += 1
+        if self._wakeup is not None and self._queued >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Отправляет всё, что выше high-water mark; возвращает False, если Google попросил подождать"""
+        while True:
+            # Пачка уже в листе, но отметка не сохранилась: без неё те же строки ушли бы повторно
+            if self._unmarked is not None:
+                await self._mark_synced(self._unmarked)
+            pending = await db.fetch_unsynced_transactions(self.sheet_name, self.batch_size)
+            if not pending:
+                return True
+            ids = [tx[0] for tx in pending]
+            try:
+                # Без таймаута run_blocking: иначе запись доработала бы в потоке, а пачка ушла бы повторно
+                await run_blocking(sheets.call, 'append_rows', [transaction_row(*tx[2:]) for tx in pending],
+                                   sheet_name=self.sheet_name, timeout=0)
+            except Exception as e:
+                self._attempts += 1
+                if is_retryable(e) and self._attempts < self.max_attempts:
+                    delay = self.backoff(self._attempts)
+                    logging.warning(f"Google Sheets: запись {len(ids)} строк отложена на {delay:.0f} с: {e}")
+                    self.retried += len(ids)
+                    self._resume_at = asyncio.get_event_loop().time() + delay
+                    return False
+                logging.error(f"Google Sheets: не удалось записать операции {ids[0]}..{ids[-1]}: {e}")
+                await db.mark_transactions_failed(ids, str(e))
+                await db.mark_transactions_synced(self.sheet_name, ids[-1])
+                self._attempts = 0
+                self.failed += len(ids)
+                self._report(pending, 'failed', None)
+                continue
+
+            # Отметку держим в памяти, пока она не сохранится в БД; если процесс упадёт
+            # раньше, пачка уйдёт в лист повторно
+            self._unmarked = ids[-1]
+            self._attempts = 0
+            self.sent += len(ids)
+            dashboard.request_refresh()
+            self._report(pending, 'sent', await self._read_balances())
+            await self._mark_synced(ids[-1])
+
+    async def _mark_synced(self, last_id):
+        try:
+            await db.mark_transactions_synced(self.sheet_name, last_id)
+        except Exception as e:
+            logging.error(f"Google Sheets: операции до {last_id} записаны в лист, но не отмечены в БД: {e}")
+            raise
+        self._unmarked = None
+
+    async def _read_balances(self):
+        try:
+            return await run_blocking(read_cells, BALANCE_CELLS)
+        except Exception as e:
+            logging.warning(f"Google Sheets: не удалось прочитать остатки: {e}")
+            return None
+
+    def _report(self, pending, status, balances):
+        """Сообщает о пачке в фоне: отправки ждут лимита Telegram, а синхронизация — нет"""
+        if self.on_status is None:
+            return
+        task = asyncio.get_event_loop().create_task(self._notify(pending, status, balances))
+        self._reports.add(task)
+        task.add_done_callback(self._reports.discard)
+
+    async def _notify(self, pending, status, balances):
+        for tx in pending:
+            transaction_id, user_id = tx[0], tx[1]
+            if user_id is None:
+                continue
+            try:
+                await self.on_status(user_id, transaction_id, status, balances)
+            except Exception as e:
+                logging.warning(f"Не удалось сообщить пользователю {user_id} об операции {transaction_id}: {e}")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            # Без новых операций не трогаем журнал: flush() берёт блокировку transactions
+            if not self._queued or asyncio.get_event_loop().time() < self._resume_at:
+                continue
+            self._queued = 0
+            try:
+                done = await self.flush()
+            except Exception as e:
+                logging.warning(f"Google Sheets: ошибка синхронизации журнала: {e}")
+                done = False
+            if not done:
+                # Отправка отложена — повторим по таймеру, даже если новых операций не будет
+                self._queued = max(self._queued, 1)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            # Первый проход отправит то, что осталось в журнале с прошлого запуска
+            self._queued = max(self._queued, 1)
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает цикл и пытается отправить то, что уже накопилось"""
+        if self._task is not None:
+            # Цикл не отменяем: текущий append_rows должен дойти до mark_transactions_synced,
+            # иначе финальный flush() отправит ту же пачку ещё раз
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.warning(f"Google Sheets: операции будут отправлены после следующего запуска: {e}")
+            await asyncio.gather(*self._reports, return_exceptions=True)
+
+    async def stats(self):
+        return {'sent': self.sent, 'failed': self.failed, 'retried': self.retried,
+                'lag': await db.get_sheet_sync_lag(self.sheet_name)}
+
+
+sheet_writer = SheetWriter()